@@ -1,20 +1,145 @@
 import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Form, File, UploadFile
 from database import get_db
 from models import *
+import numpy as np
 import pandas as pd
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+from .catalog_search import build_search_index
+from .movie_cards import invalidate_movie_cards
 import logging
 logging.basicConfig(level=logging.INFO)
 
-cached_movie_data = {"data": None}
+# Readers take cached_movie_data["snapshot"] once and use that dict for the whole request.
+# A refresh builds a complete new snapshot off to the side and publishes it with a single
+# reference swap, so nobody ever sees a half-built cache. A snapshot holds:
+#   version, kind ("full" or "delta"), built_at, build_seconds, rebuilt_at,
+#   high_water_mark, data (DataFrame), vectorizer, tfidf_matrix, movie_index,
+#   neighbour_ids, neighbour_scores, search_index (see catalog_search) and drift counters
+#   since the last full rebuild
+cached_movie_data = {"snapshot": None}
+# serializes snapshot builds so a cold request and the refresh task never build twice
+_build_lock = threading.Lock()
 
-def get_movie_data(db: Session):
-    
-    movies_query = db.query(Movie).all()
-    genres_query = db.query(GenresToMovie).all()
-    actors_query = db.query(ActorToMovie).all()
-    directors_query = db.query(DirectorToMovie).all()
+# number of most similar movies kept per movie, and rows scored per block
+NEIGHBOUR_TOP_K = 200
+NEIGHBOUR_BLOCK_SIZE = 256
+
+# Deltas reuse the vectorizer fitted by the last full rebuild. Rebuild from scratch once
+# the changed movies carry too many out-of-vocabulary tokens, once too much of the
+# catalog has changed for the old IDF weights to hold, or once a day regardless.
+VOCABULARY_DRIFT_THRESHOLD = 0.05
+CHANGED_ROWS_THRESHOLD = 0.2
+FULL_REBUILD_INTERVAL = timedelta(hours=24)
+# keep re-reading recently updated rows for a while, in case a writer committed the
+# movie and its genres/actors in separate transactions around a refresh
+DELTA_OVERLAP = timedelta(minutes=5)
+
+def build_tfidf_artifacts(movie_df: pd.DataFrame):
+    """
+    Fit the TF-IDF model over the catalog content column.
+
+    Returns the fitted vectorizer, the sparse CSR matrix (rows are already
+    L2-normalized by the vectorizer, so a dot product is a cosine similarity)
+    and a movie_id -> row index map.
+    """
+    vectorizer = TfidfVectorizer(stop_words='english')
+    tfidf_matrix = vectorizer.fit_transform(movie_df['content']).tocsr()
+    movie_index = {movie_id: row for row, movie_id in enumerate(movie_df['movie_id'].tolist())}
+    return vectorizer, tfidf_matrix, movie_index
+
+def build_neighbour_table(tfidf_matrix, movie_ids, top_k=NEIGHBOUR_TOP_K, block_size=NEIGHBOUR_BLOCK_SIZE, rows=None):
+    """
+    Materialize the top-k most similar movies for every movie, or only for
+    the matrix rows listed in rows.
+
+    Similarities are computed one block of rows at a time, so only a
+    block_size x N slice of the similarity matrix is ever dense. Returns two
+    len(rows) x k arrays: neighbour movie ids (int32) and cosine scores
+    (float32), each row ordered from most to least similar and excluding the
+    movie itself.
+    """
+    n = tfidf_matrix.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    k = min(top_k, max(n - 1, 0))
+    movie_ids = np.asarray(movie_ids, dtype=np.int32)
+    neighbour_ids = np.empty((len(rows), k), dtype=np.int32)
+    neighbour_scores = np.empty((len(rows), k), dtype=np.float32)
+    if k == 0:
+        return neighbour_ids, neighbour_scores
+
+    matrix = tfidf_matrix.astype(np.float32)
+    matrix_t = matrix.T.tocsc()
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = (matrix[block_rows] @ matrix_t).toarray()
+        block[np.arange(len(block_rows)), block_rows] = -np.inf
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        end = start + len(block_rows)
+        neighbour_ids[start:end] = movie_ids[top]
+        neighbour_scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbour_ids, neighbour_scores
+
+def merge_neighbour_candidates(neighbour_ids, neighbour_scores, matrix, candidate_matrix, candidate_ids,
+                               block_size=NEIGHBOUR_BLOCK_SIZE):
+    """
+    Merge candidate movies into existing top-k neighbour lists.
+
+    Row i of the lists belongs to row i of matrix. Entries naming a
+    candidate are dropped in favour of its fresh score, so a changed movie
+    is re-ranked rather than listed twice. Returns new arrays of the same
+    shape as the inputs.
+    """
+    k = neighbour_ids.shape[1]
+    merged_ids = neighbour_ids.copy()
+    merged_scores = neighbour_scores.copy()
+    if k == 0 or len(candidate_ids) == 0:
+        return merged_ids, merged_scores
+
+    candidate_ids = np.asarray(candidate_ids, dtype=np.int32)
+    matrix = matrix.astype(np.float32)
+    candidate_t = candidate_matrix.astype(np.float32).T.tocsc()
+    for start in range(0, matrix.shape[0], block_size):
+        end = min(start + block_size, matrix.shape[0])
+        ids = merged_ids[start:end]
+        scores = np.where(np.isin(ids, candidate_ids), -np.inf, merged_scores[start:end])
+        all_ids = np.hstack([ids, np.broadcast_to(candidate_ids, (end - start, len(candidate_ids)))])
+        all_scores = np.hstack([scores, (matrix[start:end] @ candidate_t).toarray()])
+
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(all_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        merged_ids[start:end] = np.take_along_axis(all_ids, top, axis=1)
+        merged_scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+    return merged_ids, merged_scores
+
+def load_movie_frame(db: Session, movie_ids=None):
+    """Load the catalog frame, or only the given movies when movie_ids is passed"""
+    movies_query = db.query(Movie)
+    genres_query = db.query(GenresToMovie)
+    actors_query = db.query(ActorToMovie)
+    directors_query = db.query(DirectorToMovie)
+    if movie_ids is not None:
+        movies_query = movies_query.filter(Movie.movie_id.in_(movie_ids))
+        genres_query = genres_query.filter(GenresToMovie.movie_id.in_(movie_ids))
+        actors_query = actors_query.filter(ActorToMovie.movie_id.in_(movie_ids))
+        directors_query = directors_query.filter(DirectorToMovie.movie_id.in_(movie_ids))
+    movies_query = movies_query.all()
+    genres_query = genres_query.all()
+    actors_query = actors_query.all()
+    directors_query = directors_query.all()
 
     genre_map = {}
     actor_map = {}
@@ -43,24 +168,201 @@ def get_movie_data(db: Session):
             'description': movie.description,
             'genres': genres_string,
             'director': director,
-            'actors': actors_string
+            'actors': actors_string,
+            'rating': movie.rating,
+            'release_date': movie.release_date,
+            'movie_length': movie.movie_length,
+            'image_url': movie.image_url,
+            'genre_list': genre_map.get(movie.movie_id, []),
+            'actor_list': actor_map.get(movie.movie_id, []),
         })
 
-    movie_df = pd.DataFrame(movies_data)
+    movie_df = pd.DataFrame(movies_data, columns=['movie_id', 'title', 'description', 'genres', 'director', 'actors',
+                                                  'rating', 'release_date', 'movie_length', 'image_url',
+                                                  'genre_list', 'actor_list'])
     movie_df['content'] = (movie_df['description'] + ' ' + movie_df['genres'] + ' ' +
                      movie_df['director'] + ' ' + movie_df['actors']).fillna('')
-    cached_movie_data['data'] =  movie_df
-    logging.info("✅ Fetched Movie Data")
+    return movie_df
+
+def build_catalog_snapshot(db: Session, version: int):
+    start = time.perf_counter()
+    # read the watermark first so rows changed while loading are picked up by the next delta
+    high_water_mark = db.query(func.max(Movie.updated_at)).scalar() or datetime.min
+    movie_df = load_movie_frame(db)
+    vectorizer, tfidf_matrix, movie_index = build_tfidf_artifacts(movie_df)
+    neighbour_ids, neighbour_scores = build_neighbour_table(tfidf_matrix, movie_df['movie_id'])
+    now = datetime.now()
+    return {
+        "version": version,
+        "kind": "full",
+        "built_at": now,
+        "build_seconds": time.perf_counter() - start,
+        "rebuilt_at": now,
+        "high_water_mark": high_water_mark,
+        "data": movie_df,
+        "vectorizer": vectorizer,
+        "tfidf_matrix": tfidf_matrix,
+        "movie_index": movie_index,
+        "neighbour_ids": neighbour_ids,
+        "neighbour_scores": neighbour_scores,
+        "search_index": build_search_index(movie_df),
+        "changed_rows": 0,
+        "delta_tokens": 0,
+        "oov_tokens": 0,
+    }
 
+def _count_tokens(vectorizer, documents):
+    """Return (tokens, tokens missing from the fitted vocabulary) over documents"""
+    analyzer = vectorizer.build_analyzer()
+    vocabulary = vectorizer.vocabulary_
+    tokens = 0
+    oov_tokens = 0
+    for document in documents:
+        for token in analyzer(document):
+            tokens += 1
+            if token not in vocabulary:
+                oov_tokens += 1
+    return tokens, oov_tokens
 
+def build_catalog_delta(db: Session, snapshot, version: int):
+    """
+    Apply changed and deleted movies to a snapshot without refitting TF-IDF.
+
+    Returns the snapshot unchanged when nothing moved, None when the drift
+    since the last full rebuild calls for one, otherwise a new snapshot.
+    Neighbour lists are recomputed for the changed movies, and the changed
+    movies are merged into the other lists as candidates, so new movies show
+    up in them before the next full rebuild. Other lists can still mention
+    deleted movies, so readers filter them through movie_index.
+    """
+    start = time.perf_counter()
+    high_water_mark = db.query(func.max(Movie.updated_at)).scalar() or datetime.min
+    # rows touched within the last DELTA_OVERLAP are re-applied until the window passes,
+    # which is harmless and catches relations committed after their movie row
+    since = min(snapshot["high_water_mark"], datetime.now() - DELTA_OVERLAP)
+    changed_ids = [movie_id for (movie_id,) in db.query(Movie.movie_id).filter(Movie.updated_at > since).all()]
+    live_ids = {movie_id for (movie_id,) in db.query(Movie.movie_id).all()}
+    deleted_ids = set(snapshot["movie_index"]) - live_ids
+
+    if not changed_ids and not deleted_ids:
+        return snapshot
+
+    changed_df = load_movie_frame(db, changed_ids)
+    vectorizer = snapshot["vectorizer"]
+    tokens, oov_tokens = _count_tokens(vectorizer, changed_df['content'])
+    delta_tokens = snapshot["delta_tokens"] + tokens
+    total_oov_tokens = snapshot["oov_tokens"] + oov_tokens
+    changed_rows = snapshot["changed_rows"] + len(changed_df) + len(deleted_ids)
+    old_df = snapshot["data"]
+    if (delta_tokens and total_oov_tokens / delta_tokens > VOCABULARY_DRIFT_THRESHOLD) \
+            or changed_rows > CHANGED_ROWS_THRESHOLD * max(len(old_df), 1) \
+            or len(live_ids) - 1 < snapshot["neighbour_ids"].shape[1]:
+        return None
+
+    replaced = deleted_ids.union(changed_df['movie_id'].tolist())
+    keep_rows = np.flatnonzero(~old_df['movie_id'].isin(replaced).to_numpy())
+    movie_df = pd.concat([old_df.iloc[keep_rows], changed_df], ignore_index=True)
+    tfidf_matrix = vstack([snapshot["tfidf_matrix"][keep_rows], vectorizer.transform(changed_df['content'])]).tocsr()
+    movie_index = {movie_id: row for row, movie_id in enumerate(movie_df['movie_id'].tolist())}
+
+    new_rows = np.arange(len(keep_rows), len(movie_df))
+    new_ids, new_scores = build_neighbour_table(tfidf_matrix, movie_df['movie_id'],
+                                                top_k=snapshot["neighbour_ids"].shape[1], rows=new_rows)
+    kept_ids, kept_scores = merge_neighbour_candidates(
+        snapshot["neighbour_ids"][keep_rows], snapshot["neighbour_scores"][keep_rows],
+        tfidf_matrix[:len(keep_rows)], tfidf_matrix[len(keep_rows):], changed_df['movie_id'].to_numpy(),
+    )
+    now = datetime.now()
+    return {
+        "version": version,
+        "kind": "delta",
+        "built_at": now,
+        "build_seconds": time.perf_counter() - start,
+        "rebuilt_at": snapshot["rebuilt_at"],
+        "high_water_mark": high_water_mark,
+        "data": movie_df,
+        "vectorizer": vectorizer,
+        "tfidf_matrix": tfidf_matrix,
+        "movie_index": movie_index,
+        "neighbour_ids": np.vstack([kept_ids, new_ids]),
+        "neighbour_scores": np.vstack([kept_scores, new_scores]),
+        # rebuilt rather than patched: it is a linear pass with no model to refit
+        "search_index": build_search_index(movie_df),
+        "replaced_ids": replaced,
+        "changed_rows": changed_rows,
+        "delta_tokens": delta_tokens,
+        "oov_tokens": total_oov_tokens,
+    }
+
+def _publish(snapshot):
+    # caller holds _build_lock
+    cached_movie_data["snapshot"] = snapshot
+    # ingestion runs in its own process, the movies a refresh picks up are how it reaches this one
+    invalidate_movie_cards(snapshot["replaced_ids"] if snapshot["kind"] == "delta" else None)
+    logging.info(f"✅ Fetched Movie Data ({snapshot['kind']} snapshot v{snapshot['version']}, "
+                 f"{len(snapshot['data'])} movies in {snapshot['build_seconds']:.1f}s)")
+    return snapshot
+
+def _build_and_publish(db: Session):
+    # caller holds _build_lock
+    previous = cached_movie_data["snapshot"]
+    return _publish(build_catalog_snapshot(db, version=previous["version"] + 1 if previous else 1))
+
+def get_movie_data(db: Session):
+    """Build a fresh catalog snapshot and publish it"""
+    with _build_lock:
+        return _build_and_publish(db)
+
+def refresh_movie_data(db: Session):
+    """Bring the snapshot up to date, with a row-level delta when possible"""
+    with _build_lock:
+        previous = cached_movie_data["snapshot"]
+        if previous is None or datetime.now() - previous["rebuilt_at"] > FULL_REBUILD_INTERVAL:
+            return _build_and_publish(db)
+        snapshot = build_catalog_delta(db, previous, version=previous["version"] + 1)
+        if snapshot is None:
+            return _build_and_publish(db)
+        if snapshot is previous:
+            return previous
+        return _publish(snapshot)
+
+def get_cached_movie_data(db: Session):
+    """Return the current catalog snapshot, building it first if the refresh task has not run yet"""
+    snapshot = cached_movie_data["snapshot"]
+    if snapshot is None:
+        with _build_lock:
+            snapshot = cached_movie_data["snapshot"]
+            if snapshot is None:
+                snapshot = _build_and_publish(db)
+    return snapshot
+
+def catalog_status():
+    snapshot = cached_movie_data["snapshot"]
+    if snapshot is None:
+        return {"version": None}
+    return {
+        "version": snapshot["version"],
+        "kind": snapshot["kind"],
+        "built_at": snapshot["built_at"],
+        "build_seconds": round(snapshot["build_seconds"], 3),
+        "rebuilt_at": snapshot["rebuilt_at"],
+        "movies": len(snapshot["data"]),
+        "changed_rows_since_rebuild": snapshot["changed_rows"],
+    }
+
+def _refresh_with_session():
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        refresh_movie_data(db)
+    finally:
+        db_gen.close()
 
 async def periodic_refresh(interval_minutes=30):
     while True:
-        db_gen = get_db()
-        db = next(db_gen)
         try:
-            get_movie_data(db)
-        finally:
-            db_gen.close() 
+            # the ORM loads and TF-IDF build are blocking, keep them off the event loop
+            await asyncio.to_thread(_refresh_with_session)
+        except Exception as e:
+            logging.error(f"Catalog refresh failed: {e}")
         await asyncio.sleep(interval_minutes*60)
-
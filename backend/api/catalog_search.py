@@ -0,0 +1,167 @@
+import re
+import numpy as np
+import pandas as pd
+
+# pg_trgm splits on anything that is not alphanumeric and pads each word, mirror it so
+# in-memory relevance ranks titles the way similarity() does on the database path
+_WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+
+def word_trigrams(text: str):
+    """pg_trgm style trigram set: lowercased words padded with two spaces before and one after"""
+    trigrams = set()
+    for word in _WORD_SPLIT.split(text.lower()):
+        if word:
+            padded = f"  {word} "
+            trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+def trigram_similarity(a: str, b: str) -> float:
+    a_trigrams, b_trigrams = word_trigrams(a), word_trigrams(b)
+    if not a_trigrams or not b_trigrams:
+        return 0.0
+    shared = len(a_trigrams & b_trigrams)
+    # similarity() returns a real, compute in float32 so both paths produce identical keys
+    return float(np.float32(shared) / np.float32(len(a_trigrams) + len(b_trigrams) - shared))
+
+def sort_mode(substring=None, sort_by=None) -> str:
+    """Ordering of a search: "release_date", "relevance" or "rating", each descending then by movie_id"""
+    if sort_by == "release_date":
+        return "release_date"
+    if substring and sort_by != "rating":
+        return "relevance"
+    return "rating"
+
+def _substring_trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _postings(keys_per_row):
+    postings = {}
+    for row, keys in enumerate(keys_per_row):
+        for key in keys:
+            postings.setdefault(key, []).append(row)
+    return {key: np.array(rows, dtype=np.int64) for key, rows in postings.items()}
+
+def build_search_index(movie_df: pd.DataFrame):
+    """
+    Build the facet index for the catalog frame; every structure is keyed by frame row.
+
+    genre_postings and year_postings map a genre / release year to the sorted
+    rows that have it, rating_order lists rows by ascending rating for range
+    lookups, and title_postings maps every 3-character slice of the lowercased
+    titles to the rows containing it.
+    """
+    titles = movie_df['title'].fillna('').str.lower().tolist()
+    ratings = movie_df['rating'].to_numpy(dtype=np.float64)
+    release_dates = pd.to_datetime(movie_df['release_date'])
+    years = release_dates.dt.year.fillna(-1).to_numpy(dtype=np.int64)
+    rating_order = np.argsort(ratings, kind="stable")
+    return {
+        "movie_ids": movie_df['movie_id'].to_numpy(dtype=np.int64),
+        "titles": titles,
+        "ratings": ratings,
+        # NaT sorts as the oldest date, matching NULLS LAST under a descending sort
+        "release_keys": release_dates.fillna(pd.Timestamp.min).to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        "rating_order": rating_order,
+        "sorted_ratings": ratings[rating_order],
+        "genre_postings": _postings(movie_df['genre_list']),
+        "year_postings": _postings([[year] if year >= 0 else [] for year in years]),
+        "title_postings": _postings(_substring_trigrams(title) for title in titles),
+    }
+
+def _title_rows(index, substring: str):
+    needle = substring.lower()
+    titles = index["titles"]
+    trigrams = _substring_trigrams(needle)
+    if trigrams:
+        candidates = None
+        for trigram in trigrams:
+            rows = index["title_postings"].get(trigram)
+            if rows is None:
+                return np.empty(0, dtype=np.int64)
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+    else:
+        # too short to have a trigram, fall back to a scan of the titles
+        candidates = np.arange(len(titles))
+    # the trigrams narrow it down, the containment check makes it exact
+    return np.array([row for row in candidates.tolist() if needle in titles[row]], dtype=np.int64)
+
+_NO_RELEASE_DATE = pd.Timestamp.min.value
+
+def _to_cursor_value(kind, value):
+    if kind == "release_date":
+        return None if value == _NO_RELEASE_DATE else pd.Timestamp(value).isoformat()
+    return float(value)
+
+def _from_cursor_value(kind, value):
+    if kind == "release_date":
+        return _NO_RELEASE_DATE if value is None else pd.Timestamp(value).value
+    if kind == "relevance":
+        return np.float32(value)
+    return value
+
+SORT_KEYS = {
+    "release_date": ("release_date",),
+    "relevance": ("relevance", "rating"),
+    "rating": ("rating",),
+}
+
+def search_catalog(index, substring=None, release_year=None, min_rating=None, genres=None, sort_by=None, after=None):
+    """
+    Answer a /movie/search query from the index.
+
+    Filters and ordering mirror fetch_movies' database path: genres must all
+    be present, keys sort descending with missing release dates last, ties
+    are broken by movie_id. after=(key values, movie_id) from a cursor keeps
+    only the results that come after that position.
+
+    Returns (total matches, movie ids in order, cursor_values) where
+    cursor_values(position) gives the cursor key values of a returned id.
+    """
+    row_sets = []
+    if substring:
+        row_sets.append(_title_rows(index, substring))
+    if release_year:
+        row_sets.append(index["year_postings"].get(release_year, np.empty(0, dtype=np.int64)))
+    if min_rating:
+        first = np.searchsorted(index["sorted_ratings"], min_rating, side="left")
+        row_sets.append(np.sort(index["rating_order"][first:]))
+    for genre in genres or []:
+        row_sets.append(index["genre_postings"].get(genre, np.empty(0, dtype=np.int64)))
+
+    if row_sets:
+        rows = row_sets[0]
+        for other in row_sets[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+    else:
+        rows = np.arange(len(index["movie_ids"]))
+
+    movie_ids = index["movie_ids"][rows]
+    kinds = SORT_KEYS[sort_mode(substring, sort_by)]
+    keys = []
+    for kind in kinds:
+        if kind == "release_date":
+            keys.append(index["release_keys"][rows])
+        elif kind == "relevance":
+            keys.append(np.array([trigram_similarity(index["titles"][row], substring) for row in rows.tolist()],
+                                 dtype=np.float32))
+        else:
+            keys.append(index["ratings"][rows])
+
+    if after is not None:
+        values, after_id = after
+        # same recursion as the SQL keyset condition, evaluated from the last key outwards
+        keep = movie_ids > after_id
+        for kind, key, value in reversed(list(zip(kinds, keys, values))):
+            value = _from_cursor_value(kind, value)
+            keep = (key < value) | ((key == value) & keep)
+        movie_ids = movie_ids[keep]
+        keys = [key[keep] for key in keys]
+
+    # lexsort sorts by the last key first
+    order = np.lexsort([movie_ids] + [-key for key in reversed(keys)]) if len(movie_ids) else np.arange(0)
+    movie_ids = movie_ids[order]
+    keys = [key[order] for key in keys]
+
+    def cursor_values(position):
+        return [_to_cursor_value(kind, key[position]) for kind, key in zip(kinds, keys)]
+    return len(rows), movie_ids, cursor_values
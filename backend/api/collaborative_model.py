@@ -0,0 +1,318 @@
+import asyncio
+import os
+import threading
+import time
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text, bindparam
+from database import get_db
+from dotenv import load_dotenv
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from sklearn.preprocessing import LabelEncoder
+from implicit.als import AlternatingLeastSquares
+import logging
+logging.basicConfig(level=logging.INFO)
+
+load_dotenv()
+# optional .npz file the trained factors are persisted to and warm-started from
+ALS_MODEL_PATH = os.getenv("ALS_MODEL_PATH")
+
+ALS_FACTORS = 64
+ALS_REGULARIZATION = 0.1
+ALS_ITERATIONS = 15
+ALS_ALPHA = 80
+POPULAR_FALLBACK_SIZE = 100
+
+# the whole trained state is swapped in under one key so readers never see a half-published model
+cached_als_model = {"state": None}
+
+# users whose interactions changed since their factors were last computed
+pending_user_updates = set()
+# users marked while a training runs; None when no training is running
+_marked_during_training = {"users": None}
+_pending_lock = threading.Lock()
+# serializes fold-ins with each other and with publishing a trained model
+_fold_in_lock = threading.Lock()
+
+# rows fetched per round trip from the server-side cursor
+INTERACTION_CHUNK_SIZE = 10000
+# each signal a user gave a movie adds to its confidence; times watched is log-damped
+WATCHED_WEIGHT = 1.0
+TIMES_WATCHED_WEIGHT = 1.0
+FAVORITE_WEIGHT = 2.0
+RATING_WEIGHT = 2.0
+
+def interaction_weights(has_watched, times_watched, is_favorite, rating):
+    """Vectorized confidence weight for usertomovie rows, ratings are on a 0-10 scale"""
+    return (WATCHED_WEIGHT * has_watched
+            + TIMES_WATCHED_WEIGHT * np.log1p(times_watched)
+            + FAVORITE_WEIGHT * is_favorite
+            + RATING_WEIGHT * rating / 10)
+
+def load_interactions(db: Session, weighted: bool = True, chunk_size: int = INTERACTION_CHUNK_SIZE, user_ids=None):
+    """
+    Stream the non-zero usertomovie rows into coordinate arrays.
+
+    Rows are read through a server-side cursor in chunks of chunk_size, so
+    memory follows the number of interactions rather than users x movies.
+    With weighted=False only watched movies are loaded, each with weight 1.
+    Pass user_ids to load only those users' rows.
+    Returns (user_ids, movie_ids, weights) numpy arrays.
+    """
+    if weighted:
+        condition = "has_watched OR is_favorite OR times_watched > 0 OR rating > 0"
+    else:
+        condition = "has_watched"
+    if user_ids is not None:
+        condition = f"({condition}) AND user_id IN :user_ids"
+    query = text(f"""SELECT user_id, movie_id, has_watched, times_watched, is_favorite, rating
+                     FROM usertomovie
+                     WHERE {condition}""")
+    if user_ids is not None:
+        query = query.bindparams(bindparam("user_ids", value=list(user_ids), expanding=True))
+
+    result = db.execute(query, execution_options={"stream_results": True, "yield_per": chunk_size})
+    user_chunks = []
+    movie_chunks = []
+    weight_chunks = []
+    for rows in result.partitions():
+        chunk = np.array(rows, dtype=np.float64)
+        user_chunks.append(chunk[:, 0].astype(np.int64))
+        movie_chunks.append(chunk[:, 1].astype(np.int64))
+        if weighted:
+            weight_chunks.append(interaction_weights(chunk[:, 2], chunk[:, 3], chunk[:, 4], chunk[:, 5]))
+        else:
+            weight_chunks.append(np.ones(len(chunk)))
+
+    if not user_chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    return np.concatenate(user_chunks), np.concatenate(movie_chunks), np.concatenate(weight_chunks)
+
+def _new_model():
+    return AlternatingLeastSquares(
+        factors=ALS_FACTORS,
+        regularization=ALS_REGULARIZATION,
+        iterations=ALS_ITERATIONS,
+        use_gpu=False,
+    )
+
+def _build_state(model, user_items, user_ids, movie_ids, trained_at):
+    # movies with the most interacting users, served to users the model has not seen
+    popularity = np.asarray((user_items > 0).sum(axis=0)).ravel()
+    popular_rows = np.argsort(-popularity, kind="stable")[:POPULAR_FALLBACK_SIZE]
+    return {
+        "model": model,
+        "user_items": user_items,
+        "user_ids": user_ids,
+        "movie_ids": movie_ids,
+        "user_index": {user_id: row for row, user_id in enumerate(user_ids.tolist())},
+        "movie_index": {movie_id: col for col, movie_id in enumerate(movie_ids.tolist())},
+        # interaction rows recomputed by fold_in_users since the last full training
+        "user_rows": {},
+        "popular_movie_ids": movie_ids[popular_rows],
+        "trained_at": trained_at,
+    }
+
+def train_collaborative_model(db: Session):
+    """Fit the ALS factors over all watched interactions and publish them for lookups"""
+    # users pending now are covered by the interactions loaded below; users marked from
+    # here on may be folded into the outgoing model meanwhile, so they are put back
+    # after the new model is published and folded into it as well
+    with _pending_lock:
+        pending_user_updates.clear()
+        _marked_during_training["users"] = set()
+    try:
+        _train(db)
+    finally:
+        with _pending_lock:
+            pending_user_updates.update(_marked_during_training["users"])
+            _marked_during_training["users"] = None
+
+def _train(db: Session):
+    start = time.time()
+    user_ids, movie_ids, weights = load_interactions(db)
+    if len(user_ids) == 0:
+        logging.info("No interactions found, skipping ALS training")
+        return
+
+    user_encoder = LabelEncoder()
+    movie_encoder = LabelEncoder()
+
+    user_indexes = user_encoder.fit_transform(user_ids)
+    movie_indexes = movie_encoder.fit_transform(movie_ids)
+    num_users = len(user_encoder.classes_)
+    num_movies = len(movie_encoder.classes_)
+    matrix = coo_matrix((weights, (user_indexes, movie_indexes)), shape=(num_users,num_movies))
+    weighted = (matrix.tocsr() * ALS_ALPHA).astype("double")
+
+    model = _new_model()
+    model.fit(weighted, show_progress=False)
+
+    state = _build_state(model, weighted, user_encoder.classes_, movie_encoder.classes_, time.time())
+    with _fold_in_lock:
+        cached_als_model["state"] = state
+    logging.info(f"✅ Trained ALS model on {num_users} users x {num_movies} movies in {time.time() - start:.1f}s")
+
+    if ALS_MODEL_PATH:
+        save_collaborative_model(ALS_MODEL_PATH)
+
+def save_collaborative_model(path: str):
+    state = cached_als_model["state"]
+    if state is None:
+        return
+    user_items = state["user_items"]
+    # write next to the target and rename so a crash never leaves a truncated model behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            user_factors=state["model"].user_factors,
+            item_factors=state["model"].item_factors,
+            user_ids=state["user_ids"],
+            movie_ids=state["movie_ids"],
+            user_items_data=user_items.data,
+            user_items_indices=user_items.indices,
+            user_items_indptr=user_items.indptr,
+            user_items_shape=np.array(user_items.shape),
+            trained_at=np.array(state["trained_at"]),
+        )
+    os.replace(tmp_path, path)
+    logging.info(f"Saved ALS model to {path}")
+
+def load_collaborative_model(path: str):
+    """Publish a previously saved model; returns False when there is nothing usable on disk"""
+    if not os.path.exists(path):
+        return False
+    try:
+        with np.load(path) as saved:
+            model = _new_model()
+            model.user_factors = saved["user_factors"]
+            model.item_factors = saved["item_factors"]
+            user_items = csr_matrix(
+                (saved["user_items_data"], saved["user_items_indices"], saved["user_items_indptr"]),
+                shape=tuple(saved["user_items_shape"]),
+            )
+            state = _build_state(model, user_items, saved["user_ids"], saved["movie_ids"], float(saved["trained_at"]))
+    except Exception as e:
+        logging.error(f"Could not load ALS model from {path}: {e}")
+        return False
+    with _fold_in_lock:
+        cached_als_model["state"] = state
+    logging.info(f"✅ Loaded ALS model from {path}")
+    return True
+
+def mark_user_changed(user_id: int):
+    """Record that a user's interactions changed so their factors get refreshed"""
+    with _pending_lock:
+        pending_user_updates.add(user_id)
+        if _marked_during_training["users"] is not None:
+            _marked_during_training["users"].add(user_id)
+
+def fold_in_users(db: Session, user_ids):
+    """
+    Recompute the latent factors of the given users against the fixed item factors.
+
+    Each user costs one least-squares solve, so a user's recommendations
+    reflect new interactions without refitting the whole model. Users the
+    model has never seen are appended to it. The index and interaction rows
+    are rebuilt on copies and published with the grown factors in one state
+    swap, so lock-free readers never see a row without its factors. Returns
+    False when a newer model was published meanwhile and nothing was folded.
+    """
+    state = cached_als_model["state"]
+    if state is None or not user_ids:
+        return True
+    users, movies, weights = load_interactions(db, user_ids=user_ids)
+
+    with _fold_in_lock:
+        if cached_als_model["state"] is not state:
+            return False
+        user_index = dict(state["user_index"])
+        movie_index = state["movie_index"]
+        new_users = [user_id for user_id in sorted(set(user_ids)) if user_id not in user_index]
+        user_id_array = state["user_ids"]
+        if new_users:
+            first_row = len(user_id_array)
+            for offset, user_id in enumerate(new_users):
+                user_index[user_id] = first_row + offset
+            user_id_array = np.concatenate([user_id_array, np.array(new_users, dtype=user_id_array.dtype)])
+
+        # movies added after the last training have no item factors and are skipped
+        known = np.array([movie_id in movie_index for movie_id in movies.tolist()], dtype=bool)
+        targets = sorted(set(user_ids))
+        target_position = {user_id: position for position, user_id in enumerate(targets)}
+        row_positions = np.array([target_position[user_id] for user_id in users[known].tolist()], dtype=np.int64)
+        columns = np.array([movie_index[movie_id] for movie_id in movies[known].tolist()], dtype=np.int64)
+        rows = coo_matrix(
+            (weights[known] * ALS_ALPHA, (row_positions, columns)),
+            shape=(len(targets), len(movie_index)),
+        ).tocsr()
+
+        internal_rows = np.array([user_index[user_id] for user_id in targets])
+        # grows the factor matrix before writing; rows of readers' current state only change in place
+        state["model"].partial_fit_users(internal_rows, rows)
+        user_rows = dict(state["user_rows"])
+        for position, row in enumerate(internal_rows.tolist()):
+            user_rows[row] = rows[position]
+        cached_als_model["state"] = {**state, "user_index": user_index, "user_ids": user_id_array, "user_rows": user_rows}
+    logging.info(f"Folded {len(targets)} users into the ALS model")
+    return True
+
+def fold_in_pending_users(db: Session, user_ids=None):
+    """Fold in the pending users, or only those of user_ids that are pending"""
+    with _pending_lock:
+        if user_ids is None:
+            taken = set(pending_user_updates)
+        else:
+            taken = pending_user_updates.intersection(user_ids)
+        pending_user_updates.difference_update(taken)
+    if not taken:
+        return
+    try:
+        if not fold_in_users(db, taken):
+            # a freshly published model missed them, keep them pending for it
+            with _pending_lock:
+                pending_user_updates.update(taken)
+    except Exception as e:
+        logging.error(f"ALS fold-in failed for users {sorted(taken)}: {e}")
+        with _pending_lock:
+            pending_user_updates.update(taken)
+
+def recommend_for_user(user_id: int, top_n: int = 20):
+    """
+    Look up recommendations from the trained model.
+
+    Users the model has not seen yet get the most-watched movies instead,
+    and None is returned until the first model is available.
+    """
+    state = cached_als_model["state"]
+    if state is None:
+        return None
+    row = state["user_index"].get(user_id)
+    if row is None:
+        return state["popular_movie_ids"][:top_n].tolist()
+    user_items = state["user_rows"].get(row)
+    if user_items is None:
+        user_items = state["user_items"][row]
+    movie_rows, _ = state["model"].recommend(userid=row, user_items=user_items, N=top_n)
+    return state["movie_ids"][movie_rows].tolist()
+
+def _train_with_session():
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        train_collaborative_model(db)
+    finally:
+        db_gen.close()
+
+async def periodic_model_training(interval_minutes=60):
+    if ALS_MODEL_PATH:
+        # reading the factors and building the lookup state would block every request meanwhile
+        await asyncio.to_thread(load_collaborative_model, ALS_MODEL_PATH)
+    while True:
+        try:
+            await asyncio.to_thread(_train_with_session)
+        except Exception as e:
+            logging.error(f"ALS training failed: {e}")
+        await asyncio.sleep(interval_minutes*60)
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
 # from backend.models import *
 # from backend.pydantic_models import *
 # from backend.database import get_db
@@ -10,11 +11,28 @@ from passlib.context import CryptContext
 import jwt
 from datetime import datetime, timedelta
 from collections import defaultdict
-from sqlalchemy import func, distinct, extract
-from .recommendations import get_recommendation_eng_movies
+from sqlalchemy import func, distinct, extract, cast, REAL
+from .recommendations import get_recommendation_eng_movies, invalidate_user_recommendations
+from .collaborative_model import mark_user_changed
+from .text_search import matches_substring, relevance
+from .cached_data import cached_movie_data
+from .movie_cards import with_cards, movie_card, get_movie_cards
+from .catalog_search import search_catalog, sort_mode
+from .search_cursor import search_filter_key, encode_cursor, decode_cursor, keyset_after
+from .result_cache import TTLCache
+import pandas as pd
+import asyncio
+import json
+import logging
+import threading
+import time
 
 router = APIRouter(prefix="/movie", tags=["movie"])
 
+# total matches per normalized filter set for the database search path; new movies
+# only arrive through ingestion, so a short TTL is the only invalidation needed
+search_count_cache = TTLCache(max_size=1024, ttl_seconds=300)
+
 def check_valid_request(user_id, access_token, db):
     User = db.query(Users).filter(Users.user_id == user_id).first()
     if User == None  or User.access_key != access_token:
@@ -23,37 +41,15 @@ def check_valid_request(user_id, access_token, db):
 
 @router.get("/get/{movie_id}", response_model=MovieResponse)
 def get_movie_details(movie_id: int, db: Session = Depends(get_db)):
-    movie = db.query(Movie)\
-        .options(
-            joinedload(Movie.genres),
-            joinedload(Movie.actors),
-            joinedload(Movie.directors)
-        )\
-        .filter(Movie.movie_id == movie_id)\
-        .first()
+    cards = get_movie_cards(db, [movie_id])
 
-    if not movie:
+    if not cards:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="This movie does not exist"
         )
 
-    genre_names = [genre.genre_name for genre in movie.genres]
-    actor_names = [actor.actor_name for actor in movie.actors]
-    director_name = movie.directors[0].director_name if movie.directors else None
-
-    return MovieResponse(
-        title=movie.title,
-        description=movie.description,
-        movie_length=movie.movie_length,
-        rating=movie.rating,
-        image_url=movie.image_url,
-        movie_id=movie.movie_id,
-        release_date=movie.release_date,
-        director=director_name,
-        genres=genre_names,
-        actors=actor_names
-    )
+    return MovieResponse(**cards[0])
 
 @router.get("/get_genres")
 def get_genres(db: Session = Depends(get_db)):
@@ -61,20 +57,89 @@ def get_genres(db: Session = Depends(get_db)):
     genres_list = [genre[0] for genre in genres]
     return genres_list
 
+def _snapshot_movie(movie_df, row):
+    movie = movie_df.iloc[row]
+    release_date = movie['release_date']
+    return {
+        "movie_id": int(movie['movie_id']),
+        "title": movie['title'],
+        "release_date": None if pd.isna(release_date) else release_date.to_pydatetime(),
+        "description": movie['description'],
+        "image_url": movie['image_url'],
+        "movie_length": int(movie['movie_length']),
+        "rating": float(movie['rating']),
+        "genres": list(movie['genre_list']),
+        "actors": list(movie['actor_list']),
+        "director": movie['director'],
+    }
+
+def search_snapshot(snapshot, input: SearchParams, movies_per_page: int, mode: str, filter_key, after=None):
+    """Serve a search page from the in-memory catalog index, without touching the database"""
+    total_movies, movie_ids, cursor_values = search_catalog(
+        snapshot["search_index"],
+        substring=input.substring,
+        release_year=input.release_date,
+        min_rating=input.min_rating,
+        genres=input.genres,
+        sort_by=input.sort_by,
+        after=after,
+    )
+    offset = 0 if after is not None else (input.page - 1) * movies_per_page
+    page_ids = movie_ids[offset:offset + movies_per_page].tolist()
+    if not page_ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No movies found with the given filters"
+        )
+    next_cursor = None
+    if offset + movies_per_page < len(movie_ids):
+        last = offset + len(page_ids) - 1
+        next_cursor = encode_cursor(filter_key, mode, cursor_values(last), page_ids[-1])
+    movie_index = snapshot["movie_index"]
+    return {
+        "results": [_snapshot_movie(snapshot["data"], movie_index[movie_id]) for movie_id in page_ids],
+        "totalPages": (total_movies + movies_per_page - 1) // movies_per_page,
+        "nextCursor": next_cursor
+    }
+
+def _search_sort_keys(mode: str, substring):
+    """Sort expressions of a search mode, all descending, and how a cursor value binds to each"""
+    if mode == "release_date":
+        return [(Movie.release_date, lambda value: datetime.fromisoformat(value))]
+    if mode == "relevance":
+        # similarity() is a real; compare cursor values as reals so ties match exactly
+        return [(relevance(Movie.title, substring), lambda value: cast(value, REAL)),
+                (Movie.rating, lambda value: value)]
+    return [(Movie.rating, lambda value: value)]
+
 @router.post("/search", status_code=status.HTTP_200_OK)
 def fetch_movies(
     input: SearchParams,
     db: Session = Depends(get_db),
 ):
+    """
+    Search the catalog, 16 movies a page.
+
+    Pages are addressed either by page number or, for deep paging, by the
+    nextCursor returned with every page: a cursor resumes right after the
+    last movie of the previous page instead of skipping rows with OFFSET.
+    """
     print(input)
 
     movies_per_page = 16
-    offset = (input.page - 1) * movies_per_page
+    filter_key = search_filter_key(input.substring, input.release_date, input.min_rating, input.genres)
+    mode = sort_mode(input.substring, input.sort_by)
+    after = decode_cursor(input.cursor, filter_key, mode) if input.cursor else None
+
+    # answered from the catalog snapshot when it is loaded, the queries below are the cold path
+    snapshot = cached_movie_data["snapshot"]
+    if snapshot is not None:
+        return search_snapshot(snapshot, input, movies_per_page, mode, filter_key, after)
 
     base_query = db.query(Movie)
 
     if input.substring:
-        base_query = base_query.filter(Movie.title.ilike(f"%{input.substring}%"))
+        base_query = base_query.filter(matches_substring(Movie.title, input.substring))
     if input.release_date:
         base_query = base_query.filter(extract('year', Movie.release_date) == input.release_date)
 
@@ -94,63 +159,59 @@ def fetch_movies(
         base_query = base_query.filter(Movie.movie_id.in_(genre_movie_ids))
 
 
-    # Get distinct count of movies before applying offset and limit
-    total_movies = base_query.distinct(Movie.movie_id).count()
-    total_pages = (total_movies + movies_per_page - 1) // movies_per_page  # ceiling division
-
-    if input.sort_by == "release_date":
-        base_query = base_query.order_by(Movie.movie_id, Movie.release_date.desc())
+    count_query = base_query
+    sort_keys = _search_sort_keys(mode, input.substring)
+    key_columns = [key for key, _ in sort_keys]
+    # the page, its cards and the sort keys for the cursor all come back in one query
+    base_query = with_cards(base_query).add_columns(*key_columns)
+
+    # every filter is on movie itself or an IN subquery, so rows are already distinct;
+    # the count only depends on the filters, so it is shared by every page and sort order
+    total_movies = search_count_cache.get(filter_key)
+    if total_movies is None and after is not None:
+        total_movies = count_query.count()
+        search_count_cache.set(filter_key, total_movies)
+    elif total_movies is None:
+        # without a cursor the window runs over every match, so the page query counts too
+        base_query = base_query.add_columns(func.count().over())
+
+    # movie_id breaks ties so pages never overlap
+    base_query = base_query.order_by(*[key.desc().nulls_last() for key in key_columns], Movie.movie_id)
+    if after is not None:
+        values, after_id = after
+        bound = [None if value is None else to_sql(value) for (_, to_sql), value in zip(sort_keys, values)]
+        base_query = base_query.filter(keyset_after(key_columns, bound, Movie.movie_id, after_id))
     else:
-        base_query = base_query.order_by(Movie.movie_id, Movie.rating.desc())
+        base_query = base_query.offset((input.page - 1) * movies_per_page)
 
-    base_query = base_query.distinct(Movie.movie_id)
+    # one extra row tells whether there is a next page
+    rows = base_query.limit(movies_per_page + 1).all()
 
-    movies = (
-        base_query
-        .offset(offset)
-        .limit(movies_per_page)
-        .all()
-    )
-
-    if not movies:
+    if not rows:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No movies found with the given filters"
         )
 
-    movie_ids = [m.movie_id for m in movies]
-
-    genres_for_movies = db.query(GenresToMovie).filter(GenresToMovie.movie_id.in_(movie_ids)).all()
-    genres_map = {}
-    for g in genres_for_movies:
-        genres_map.setdefault(g.movie_id, []).append(g.genre_name)
-
-    actors_for_movies = db.query(ActorToMovie).filter(ActorToMovie.movie_id.in_(movie_ids)).all()
-    actors_map = {}
-    for a in actors_for_movies:
-        actors_map.setdefault(a.movie_id, []).append(a.actor_name)
-
-    directors_for_movies = db.query(DirectorToMovie).filter(DirectorToMovie.movie_id.in_(movie_ids)).all()
-    directors_map = {d.movie_id: d.director_name for d in directors_for_movies}
-
-    results = []
-    for movie in movies:
-        results.append({
-            "movie_id": movie.movie_id,
-            "title": movie.title,
-            "release_date": movie.release_date,
-            "description": movie.description,
-            "image_url": movie.image_url,
-            "movie_length": movie.movie_length,
-            "rating": movie.rating,
-            "genres": genres_map.get(movie.movie_id, []),
-            "actors": actors_map.get(movie.movie_id, []),
-            "director": directors_map.get(movie.movie_id),
-        })
+    if total_movies is None:
+        total_movies = rows[0][-1]
+        search_count_cache.set(filter_key, total_movies)
+    total_pages = (total_movies + movies_per_page - 1) // movies_per_page  # ceiling division
+
+    next_cursor = None
+    if len(rows) > movies_per_page:
+        rows = rows[:movies_per_page]
+        last = rows[-1]
+        key_values = last[4:4 + len(key_columns)]
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in key_values]
+        next_cursor = encode_cursor(filter_key, mode, values, last[0].movie_id)
+
+    results = [movie_card(*row[:4]) for row in rows]
 
     return {
         "results": results,
-        "totalPages": total_pages
+        "totalPages": total_pages,
+        "nextCursor": next_cursor
     }
 
     # return {
@@ -195,6 +256,8 @@ def update_user_to_movie(input: UserToMovieModel, db: Session = Depends(get_db))
         db.add(relation)
         db.commit()
         db.refresh(relation)
+        mark_user_changed(input.user_id)
+        invalidate_user_recommendations(input.user_id)
 
         return relation
     if input.times_watched is not None:
@@ -209,6 +272,8 @@ def update_user_to_movie(input: UserToMovieModel, db: Session = Depends(get_db))
         relation.rating = input.rating
     db.commit()
     db.refresh(relation)
+    mark_user_changed(input.user_id)
+    invalidate_user_recommendations(input.user_id)
     return relation
 
 @router.get("/actions", status_code=status.HTTP_200_OK)
@@ -251,12 +316,7 @@ def get_all_user_movie_info(
     UserToMovie.user_id == user_id
     ).all()
     movie_ids = [entry.movie_id for entry in user_movie_entries]
-    movies = db.query(Movie).options(
-    joinedload(Movie.genres),
-    joinedload(Movie.actors),
-    joinedload(Movie.directors)
-    ).filter(Movie.movie_id.in_(movie_ids)).all()
-    movie_map = {movie.movie_id: movie for movie in movies}
+    movie_map = {card["movie_id"]: card for card in get_movie_cards(db, movie_ids)}
 
     result = []
     for entry in user_movie_entries:
@@ -264,10 +324,6 @@ def get_all_user_movie_info(
         if not movie:
             continue
 
-        genre_names = [genre.genre_name for genre in movie.genres]
-        actor_names = [actor.actor_name for actor in movie.actors]
-        director_name = movie.directors[0].director_name if movie.directors else None
-
         result.append({
                 "user_action": {
                     "has_watched": entry.has_watched,
@@ -276,18 +332,7 @@ def get_all_user_movie_info(
                     "watching_now": entry.watching_now,
                     "rating": entry.rating,
                 },
-                "movie": {
-                    "title": movie.title,
-                    "description": movie.description,
-                    "movie_length": movie.movie_length,
-                    "rating": movie.rating,
-                    "image_url": movie.image_url,
-                    "movie_id": movie.movie_id,
-                    "release_date": movie.release_date,
-                    "director": director_name,
-                    "genres": genre_names,
-                    "actors": actor_names
-                }
+                "movie": movie
             })
 
     return result
@@ -299,18 +344,17 @@ def get_movie_history(user_id: int, access_key: str, db: Session = Depends(get_d
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="This request is unauthorized or this user does not exist"
                 )
-    results = (
-        db.query(UserToMovie, Movie)
-        .join(Movie, UserToMovie.movie_id == Movie.movie_id)
-        .filter(UserToMovie.user_id == user_id)
-        .all()
-        )
+    entries = db.query(UserToMovie).filter(UserToMovie.user_id == user_id).all()
+    movie_map = {card["movie_id"]: card for card in get_movie_cards(db, [utm.movie_id for utm in entries])}
 
     favorite_movies = []
     movie_history = []
     most_watched_temp = []
     watching_now = []
-    for utm, movie in results:
+    for utm in entries:
+        movie = movie_map.get(utm.movie_id)
+        if not movie:
+            continue
         if utm.times_watched > 0:
             most_watched_temp.append((movie, utm.times_watched))
         if utm.is_favorite:
@@ -412,11 +456,91 @@ def get_recent_movies( db: Session):
     )
     return new_movies
 
+def get_popular_movies_by_genre(db: Session, limit: int = 20):
+    """The limit best rated movies of every genre, {genre: [movie]}, from one windowed query"""
+    rank = func.row_number().over(
+        partition_by=GenresToMovie.genre_name,
+        order_by=(Movie.rating.desc(), Movie.movie_id)
+    ).label("rank")
+    ranked = (
+        db.query(GenresToMovie.genre_name.label("genre_name"), GenresToMovie.movie_id.label("movie_id"), rank)
+        .join(Movie, Movie.movie_id == GenresToMovie.movie_id)
+        .subquery()
+    )
+    rows = (
+        db.query(ranked.c.genre_name, Movie)
+        .join(Movie, Movie.movie_id == ranked.c.movie_id)
+        .filter(ranked.c.rank <= limit)
+        .order_by(ranked.c.genre_name, ranked.c.rank)
+        .all()
+    )
+    popular_by_genre = {}
+    for genre_name, movie in rows:
+        popular_by_genre.setdefault(genre_name, []).append(movie)
+    return popular_by_genre
+
+def _to_json(value) -> bytes:
+    return json.dumps(jsonable_encoder(value)).encode()
+
+# the anonymous landing sections are the same for every visitor, so a background task
+# builds them and the route splices the stored JSON into its response as-is
+landing_sections = {"sections": None}
+_landing_lock = threading.Lock()
+
+def build_landing_sections(db: Session):
+    """
+    Serialize the shared landing sections.
+
+    "popular" and "new" are the JSON arrays of the two lists, "popular_by_genre"
+    maps a genre to its own popular array.
+    """
+    start = time.perf_counter()
+    popular_by_genre = get_popular_movies_by_genre(db)
+    sections = {
+        "popular": _to_json(get_popular_suggested_movies(db=db)),
+        "new": _to_json(get_recent_movies(db=db)),
+        "popular_by_genre": {genre: _to_json(movies) for genre, movies in popular_by_genre.items()},
+    }
+    landing_sections["sections"] = sections
+    logging.info(f"✅ Built landing sections ({len(popular_by_genre)} genres in {time.perf_counter() - start:.1f}s)")
+    return sections
+
+def get_landing_sections(db: Session):
+    """Return the current landing sections, building them first if the refresh task has not run yet"""
+    sections = landing_sections["sections"]
+    if sections is None:
+        with _landing_lock:
+            sections = landing_sections["sections"]
+            if sections is None:
+                sections = build_landing_sections(db)
+    return sections
+
+def _build_landing_with_session():
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        build_landing_sections(db)
+    finally:
+        db_gen.close()
+
+async def periodic_landing_refresh(interval_seconds=60):
+    while True:
+        try:
+            await asyncio.to_thread(_build_landing_with_session)
+        except Exception as e:
+            logging.error(f"Landing sections refresh failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
 @router.get("/landing_page_movies")
-def get_landing_page_movies(user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    result = {}
-    result['popular_movies'] = get_popular_suggested_movies(db=db)
-    result['new_movies'] = get_recent_movies(db=db)
+def get_landing_page_movies(user_id: Optional[int] = None, genre: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Landing page rows. popular_movies and new_movies come precomputed, limited
+    to one genre's popular list when genre is given; only the recommendation
+    rows of a signed in user are computed per request.
+    """
+    sections = get_landing_sections(db)
+    popular = sections["popular_by_genre"].get(genre, b"[]") if genre else sections["popular"]
+    body = b'{"popular_movies":' + popular + b',"new_movies":' + sections["new"]
     if (user_id):
         user = db.query(Users).filter(Users.user_id == user_id).first()
         if not user:
@@ -425,12 +549,13 @@ def get_landing_page_movies(user_id: Optional[int] = None, db: Session = Depends
                 detail="User does not exist",
             )
         try:
-            result['recommended_movies'] = get_recommendation_eng_movies(user_id,1,20,db)
-            result['collaborative_movies'] = get_recommendation_eng_movies(user_id,3,20,db=db)
+            recommended_movies = get_recommendation_eng_movies(user_id,1,20,db)
+            collaborative_movies = get_recommendation_eng_movies(user_id,3,20,db=db)
         except Exception as e:
-            result['recommended_movies'] = []
-            result['collaborative_movies'] = []
-    return result
+            recommended_movies = []
+            collaborative_movies = []
+        body += b',"recommended_movies":' + _to_json(recommended_movies) + b',"collaborative_movies":' + _to_json(collaborative_movies)
+    return Response(content=body + b"}", media_type="application/json")
 
 @router.get("/get_movie_recommendation/{movie_id}")
 def get_movie_watchlist_recommendations(movie_id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,89 @@
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from models import Movie, MovieCard, GenresToMovie, ActorToMovie, DirectorToMovie
+from .result_cache import TTLCache
+
+# cards only change when ingestion rewrites a movie, which the catalog refresh notices and
+# invalidates (see cached_data._publish); the TTL bounds anything that slips through
+movie_card_cache = TTLCache(max_size=20000, ttl_seconds=6*60*60)
+
+def _aggregate(column, movie_id_column):
+    return (
+        select(func.array_agg(column))
+        .where(movie_id_column == Movie.movie_id)
+        .correlate(Movie)
+        .scalar_subquery()
+    )
+
+def card_columns():
+    """
+    Genres, actors and director of the selected movie, read from the movie_card view.
+
+    A view row is only used while it matches the movie's updated_at; movies
+    written or changed since the view's last refresh are aggregated from the
+    relation tables instead, so cards are never staler than the movie row.
+    """
+    fresh = MovieCard.updated_at == Movie.updated_at
+    genres = case((fresh, MovieCard.genres), else_=_aggregate(GenresToMovie.genre_name, GenresToMovie.movie_id))
+    actors = case((fresh, MovieCard.actors), else_=_aggregate(ActorToMovie.actor_name, ActorToMovie.movie_id))
+    director = case(
+        (fresh, MovieCard.director),
+        else_=select(DirectorToMovie.director_name)
+        .where(DirectorToMovie.movie_id == Movie.movie_id)
+        .correlate(Movie)
+        .limit(1)
+        .scalar_subquery(),
+    )
+    return genres, actors, director
+
+def with_cards(query):
+    """Add the card columns to a query over Movie, rows become (movie, genres, actors, director, ...)"""
+    return query.outerjoin(MovieCard, MovieCard.movie_id == Movie.movie_id).add_columns(*card_columns())
+
+def movie_card(movie: Movie, genres, actors, director):
+    """Card of a movie row selected through with_cards, the shape MovieResponse validates"""
+    return {
+        "movie_id": movie.movie_id,
+        "title": movie.title,
+        "release_date": movie.release_date,
+        "description": movie.description,
+        "image_url": movie.image_url,
+        "movie_length": movie.movie_length,
+        "rating": movie.rating,
+        # array_agg over no rows is NULL
+        "genres": list(genres or []),
+        "actors": list(actors or []),
+        "director": director,
+    }
+
+def load_movie_cards(db: Session, movie_ids):
+    """Cards of the given movies in one query, keyed by movie_id; unknown ids are left out"""
+    if not movie_ids:
+        return {}
+    rows = with_cards(db.query(Movie).filter(Movie.movie_id.in_(movie_ids))).all()
+    return {row[0].movie_id: movie_card(*row) for row in rows}
+
+def get_movie_cards(db: Session, movie_ids):
+    """
+    Cards of the given movies in the given order, unknown ids left out.
+
+    Cached cards are shared between requests and must not be modified.
+    Misses are loaded together with one load_movie_cards query.
+    """
+    movie_ids = list(movie_ids)
+    cards = movie_card_cache.get_many(movie_ids)
+    missing = [movie_id for movie_id in dict.fromkeys(movie_ids) if movie_id not in cards]
+    if missing:
+        loaded = load_movie_cards(db, missing)
+        for movie_id, card in loaded.items():
+            movie_card_cache.set(movie_id, card)
+        cards.update(loaded)
+    return [cards[movie_id] for movie_id in movie_ids if movie_id in cards]
+
+def invalidate_movie_cards(movie_ids=None):
+    """Drop the cached cards of movie_ids, or every card when movie_ids is None"""
+    if movie_ids is None:
+        movie_card_cache.invalidate_where(lambda movie_id: True)
+        return
+    for movie_id in movie_ids:
+        movie_card_cache.invalidate(movie_id)
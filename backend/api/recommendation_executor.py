@@ -0,0 +1,64 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import logging
+logging.basicConfig(level=logging.INFO)
+
+class RecommendationExecutor:
+    """
+    Dedicated, bounded pool for recommendation engine work.
+
+    At most max_pending jobs are queued or running at once; run() refuses new
+    work beyond that instead of queueing it, and stops waiting after
+    timeout_seconds. In both cases it returns None so the caller can serve a
+    cheap fallback. A job that timed out keeps its slot until it finishes,
+    so slow work cannot pile up behind the limit.
+    """
+    def __init__(self, max_workers: int = 2, max_pending: int = 8, timeout_seconds: float = 5):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommendation")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def run(self, fn, *args):
+        """Run fn(*args) in the pool and wait for its result, None when saturated or timed out"""
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            logging.warning("Recommendation executor saturated, serving fallback")
+            return None
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=self.timeout_seconds)
+        except FuturesTimeoutError:
+            self._count("timed_out")
+            logging.warning(f"Recommendation job exceeded {self.timeout_seconds}s, serving fallback")
+            return None
+        self._count("completed")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "timeout_seconds": self.timeout_seconds,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
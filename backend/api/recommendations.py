@@ -19,59 +19,51 @@ from models import *
 from pydantic_models import *
 from database import get_db, initialize_database
 import asyncio
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import coo_matrix
-from sklearn.preprocessing import LabelEncoder
+import numpy as np
 import pandas as pd
-from sqlalchemy.sql import text
-from implicit.als import AlternatingLeastSquares
 
-from .cached_data import cached_movie_data, get_movie_data
+from .cached_data import get_cached_movie_data, catalog_status
+from .collaborative_model import recommend_for_user, fold_in_pending_users
+from .result_cache import TTLCache
+from .movie_cards import get_movie_cards
+from .recommendation_executor import RecommendationExecutor
+from database import SyncSessionLocal
 
 router = APIRouter(prefix="/recommendation", tags=["recommendation"])
 
-def get_movie_data(db: Session):
-    
-    movies_query = db.query(Movie).all()
-    genres_query = db.query(GenresToMovie).all()
-    actors_query = db.query(ActorToMovie).all()
-    directors_query = db.query(DirectorToMovie).all()
-
-    genre_map = {}
-    actor_map = {}
-    director_map = {}
-
-    for genre in genres_query:
-        if genre.movie_id not in genre_map:
-            genre_map[genre.movie_id] = []
-        genre_map[genre.movie_id].append(genre.genre_name)
-    for actor in actors_query:
-        if actor.movie_id not in actor_map:
-            actor_map[actor.movie_id] = []
-        actor_map[actor.movie_id].append(actor.actor_name)
-    for director in directors_query:
-        director_map[director.movie_id] = director.director_name
-
-    movies_data = []
-    for movie in movies_query:
-        genres_string = ', '.join(genre_map.get(movie.movie_id, []))
-        actors_string = ', '.join(actor_map.get(movie.movie_id, []))
-        director = director_map.get(movie.movie_id, None)
-
-        movies_data.append({
-            'movie_id': movie.movie_id,
-            'title': movie.title,
-            'description': movie.description,
-            'genres': genres_string,
-            'director': director,
-            'actors': actors_string
-        })
-
-    movie_df = pd.DataFrame(movies_data)
-    movie_df['content'] = (movie_df['description'] + ' ' + movie_df['genres'] + ' ' +
-                     movie_df['director'] + ' ' + movie_df['actors']).fillna('')
-    return movie_df
+# engine results keyed by (ID, type_action, movie_num), holding lists of movie ids
+recommendation_cache = TTLCache(max_size=4096, ttl_seconds=30*60)
+
+# engine work runs here rather than in the shared request threadpool
+recommendation_executor = RecommendationExecutor(max_workers=2, max_pending=8, timeout_seconds=5)
+
+# engine types whose ID is a user id, and the one whose ID is a watchlist id
+USER_ENGINE_TYPES = (1, 3)
+WATCHLIST_ENGINE_TYPE = 2
+
+def invalidate_user_recommendations(user_id: int):
+    """Drop cached results built from a user's movie interactions"""
+    recommendation_cache.invalidate_where(lambda key: key[0] == user_id and key[1] in USER_ENGINE_TYPES)
+
+def invalidate_watchlist_recommendations(watchlist_id: int):
+    """Drop cached results built from a watchlist's movies"""
+    recommendation_cache.invalidate_where(lambda key: key[0] == watchlist_id and key[1] == WATCHLIST_ENGINE_TYPE)
+
+@router.get("/cache_stats")
+def get_recommendation_cache_stats():
+    return recommendation_cache.stats()
+
+@router.get("/catalog_status")
+def get_catalog_status():
+    return catalog_status()
+
+@router.get("/executor_stats")
+def get_recommendation_executor_stats():
+    return recommendation_executor.stats()
+
+def get_popular_movie_ids(movie_num: int, db: Session):
+    movies = db.query(Movie.movie_id).order_by(Movie.rating.desc()).limit(movie_num).all()
+    return [movie_id for (movie_id,) in movies]
 
 def get_user_watched_movies(user_id,db):
     movies = db.query(UserToMovie.movie_id).filter(UserToMovie.user_id == user_id,UserToMovie.has_watched == True).all()
@@ -84,118 +76,77 @@ def get_watchlist_movies(watchlist_id,db):
     return movie_ids_list
 
 def movie_based_recommendation(movie_id, db,top_n=10):
-    if cached_movie_data is None:
-        df = get_movie_data(db)
-    else:
-        df = cached_movie_data['data']
-    #df = get_movie_data(db)
-    tfidf = TfidfVectorizer(stop_words='english')
-    
-    # df['content'] = df['description'] + ' ' + df['genres'] + ' ' + df['director'] + ' ' + df['actors']
-    # df['content'] = df['content'].fillna('')
-
-    tfidf_matrix = tfidf.fit_transform(df['content'])
-    
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    
-    idx = df[df['movie_id'] == movie_id].index[0]
-    
-    sim_scores = list(enumerate(cosine_sim[idx]))
-    
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    
-    sim_scores = [score for score in sim_scores if df['movie_id'].iloc[score[0]] != movie_id]
-
-    top_movies = sim_scores[1:top_n+100]
-    top_movie_indices = [i[0] for i in top_movies]
-    
-    recommended_movies = df['movie_id'].iloc[top_movie_indices]
-    return recommended_movies.tolist()
+    cache = get_cached_movie_data(db)
+    idx = cache['movie_index'][movie_id]
+
+    # neighbours are precomputed at refresh time, most similar first; after a
+    # delta refresh a list can still name a deleted movie, so keep live ones only
+    movie_index = cache['movie_index']
+    top_movies = [m for m in cache['neighbour_ids'][idx].tolist() if m in movie_index]
+    return top_movies[:top_n+100]
 
 def user_collaborative_recommendation(user_id,db,top_n=20):
-    if cached_movie_data is None:
-        df = get_movie_data(db)
-    else:
-        df = cached_movie_data['data']
-    query = text("""SELECT 
-                        u.user_id as User, 
-                        m.movie_id as Movie,
-                        CASE 
-                            WHEN utm.has_watched = TRUE THEN 1
-                            ELSE 0
-                        END AS Check
-                    FROM 
-                        users AS u
-                    CROSS JOIN 
-                        movie AS m
-                    LEFT OUTER JOIN 
-                        usertomovie AS utm 
-                        ON u.user_id = utm.user_id AND m.movie_id = utm.movie_id;
-                """)
-
-    results = db.execute(query).fetchall()
-    user_ids = []
-    movie_ids = []
-    data = []
-
-    for user, movie, check in results:
-        if check == 1: 
-            user_ids.append(user)
-            movie_ids.append(movie)
-            data.append(1)
-    user_encoder = LabelEncoder()
-    movie_encoder = LabelEncoder()
-
-    user_indexes = user_encoder.fit_transform(user_ids)
-    movie_indexes = movie_encoder.fit_transform(movie_ids)
-    num_users = len(user_encoder.classes_)
-    num_movies = len(movie_encoder.classes_)
-    matrix = coo_matrix((data, (user_indexes, movie_indexes)), shape=(num_users,num_movies))
-    CSR_Matrix = matrix.tocsr()
-
-    model = AlternatingLeastSquares(factors=64, regularization=0.1, iterations=15,use_gpu=False)
-    alpha = 80
-    weighted = (CSR_Matrix * alpha).astype("double")
-    model.fit(weighted)
-
-    user_internal_id = user_encoder.transform([user_id])[0]
-    recommended_movies = model.recommend(userid=user_internal_id, user_items=weighted[user_internal_id], N=top_n)
-    movie_ids, _ = recommended_movies
-    decode = lambda mid: movie_encoder.inverse_transform([mid])[0]
-    filtered_movie_ids = [decode(mid) for mid in (movie_ids)]
-    #movies = df[df['movie_id'].isin(filtered_movie_ids) ]
-    return filtered_movie_ids
+    # the ALS factors are trained by the background job in collaborative_model,
+    # a user whose interactions changed since then is folded in first;
+    # None until the first model is published
+    fold_in_pending_users(db, [user_id])
+    return recommend_for_user(user_id, top_n=top_n)
 
 def user_content_recommendations(ID,db, type_rec=1, top_n=20):
-    if cached_movie_data is None:
-        all_movies = get_movie_data(db)
-    else:
-        all_movies = cached_movie_data['data']
-    #all_movies = get_movie_data(db)
+    cache = get_cached_movie_data(db)
+    all_movies = cache['data']
     if type_rec == 1:
         selected_movies = get_user_watched_movies(ID,db)
     else:
         selected_movies = get_watchlist_movies(ID,db)
     if not selected_movies or len(selected_movies) == 0:
         return []
-    # all_movies['content'] = (all_movies['description'] + ' ' + all_movies['genres'] + ' ' +
-    #                  all_movies['director'] + ' ' + all_movies['actors']).fillna('')
-    TFIDF = TfidfVectorizer(stop_words='english')
-    matrix = TFIDF.fit_transform(all_movies['content'])
+    matrix = cache['tfidf_matrix']
 
-    selected_indices = all_movies[all_movies['movie_id'].isin(selected_movies)].index
+    selected_indices = np.flatnonzero(all_movies['movie_id'].isin(selected_movies).to_numpy())
+    top_n = min(top_n, matrix.shape[0] - len(selected_indices))
+    if len(selected_indices) == 0 or top_n <= 0:
+        return []
 
-    user_sim_vector = cosine_similarity(matrix[selected_indices], matrix)
-    mean_scores = user_sim_vector.mean(axis=0)
+    # rows are L2-normalized, so scoring the summed profile once gives the summed
+    # cosine similarity to every watched movie, which ranks the same as the mean
+    profile = np.asarray(matrix[selected_indices].sum(axis=0)).ravel()
+    scores = matrix @ profile
 
-    mean_scores[selected_indices] = -1
+    scores[selected_indices] = -np.inf
 
-    top_indices = mean_scores.argsort()[-top_n:][::-1]
+    top_indices = np.argpartition(-scores, top_n - 1)[:top_n]
+    top_indices = top_indices[np.argsort(-scores[top_indices])]
 
-    recommended_movies = all_movies.iloc[top_indices]['movie_id'].tolist()
+    recommended_movies = all_movies['movie_id'].iloc[top_indices].tolist()
     return recommended_movies
 
 def get_recommendation_eng_movies(ID: int, type_action: int, movie_num: int, db: Session = Depends(get_db)):
+    cache_key = (ID, type_action, movie_num)
+    movie_id_list = recommendation_cache.get(cache_key)
+    if movie_id_list is None:
+        # taken before the engine reads any interactions, so a write committed meanwhile keeps the result out
+        generation = recommendation_cache.generation(cache_key)
+        movie_id_list = recommendation_executor.run(_compute_recommendation_ids_in_worker, ID, type_action, movie_num)
+        if movie_id_list is None:
+            # the executor is saturated, the job is too slow or no model is trained yet; fall back without caching
+            movie_id_list = get_popular_movie_ids(movie_num, db)
+        else:
+            recommendation_cache.set(cache_key, movie_id_list, generation)
+    if len(movie_id_list) > 0:
+        # cards keep the ranking order, which the IN query used to lose
+        return get_movie_cards(db, movie_id_list)
+    return {}
+
+def _compute_recommendation_ids_in_worker(ID: int, type_action: int, movie_num: int):
+    # the request's session must not be shared with the worker thread, which may outlive a timed out request
+    db = SyncSessionLocal()
+    try:
+        return compute_recommendation_ids(ID, type_action, movie_num, db)
+    finally:
+        db.close()
+
+def compute_recommendation_ids(ID: int, type_action: int, movie_num: int, db: Session):
     movie_id_list = []
     if type_action == 0: # content-content movie
         movie_id_list = movie_based_recommendation(ID, db, top_n=movie_num)
@@ -219,9 +170,6 @@ def get_recommendation_eng_movies(ID: int, type_action: int, movie_num: int, db:
         movie_id_list = user_content_recommendations(ID,db, type_rec=0)
     elif type_action == 3:
         movie_id_list = user_collaborative_recommendation(ID,db)
-    if len(movie_id_list) > 0:
-        result = db.query(Movie).filter(Movie.movie_id.in_(movie_id_list)).all()
-        return result
-    return {}
+    return movie_id_list
 
     
\ No newline at end of file
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    Bounded, thread-safe LRU cache whose entries also expire after ttl_seconds.
+
+    Keeps hit/miss/eviction counters so callers can report how well it works.
+    Expired entries count as misses; entries pushed out by the size bound or
+    by explicit invalidation count as evictions.
+
+    A caller computing a value can take generation(key) first and pass it to
+    set(); the value is then dropped if the key was invalidated meanwhile.
+    """
+    def __init__(self, max_size: int = 4096, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # generation of every key handed out or invalidated since the last reset;
+        # keys missing here are at _generation_floor
+        self._generations = {}
+        self._generation_floor = 0
+        self._generation_tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are cached and fresh, under one lock acquisition"""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] <= now:
+                    if entry is not None:
+                        del self._entries[key]
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+        return found
+
+    def generation(self, key):
+        """Current generation of key, to be passed to set() after computing its value"""
+        with self._lock:
+            if len(self._generations) >= self.max_size and key not in self._generations:
+                # forget every generation at once; values computed before this are not stored
+                self._bump_floor()
+            return self._generations.setdefault(key, self._generation_floor)
+
+    def _bump_floor(self):
+        self._generation_tick += 1
+        self._generation_floor = self._generation_tick
+        self._generations.clear()
+
+    def _bump(self, key):
+        self._generation_tick += 1
+        self._generations[key] = self._generation_tick
+
+    def set(self, key, value, generation=None):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._generation_floor) != generation:
+                return
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._bump(key)
+            if self._entries.pop(key, None) is not None:
+                self.evictions += 1
+
+    def invalidate_where(self, predicate):
+        """Drop every key for which predicate(key) is true"""
+        with self._lock:
+            for key in [key for key in self._generations if predicate(key)]:
+                self._bump(key)
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            self.evictions += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bump_floor()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
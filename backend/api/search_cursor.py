@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import json
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+def search_filter_key(substring=None, release_year=None, min_rating=None, genres=None):
+    """Normalized filter set of a search, equal for requests that match the same movies"""
+    return (
+        substring or None,
+        release_year or None,
+        min_rating or None,
+        tuple(sorted(set(genres))) if genres else None,
+    )
+
+def _fingerprint(filter_key, mode: str) -> str:
+    return hashlib.sha1(json.dumps([filter_key, mode]).encode()).hexdigest()[:12]
+
+def encode_cursor(filter_key, mode: str, values, movie_id: int) -> str:
+    """Opaque cursor for the position after movie_id, whose sort key values are values"""
+    payload = {"f": _fingerprint(filter_key, mode), "k": values, "id": movie_id}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, filter_key, mode: str):
+    """Return (sort key values, movie_id) of a cursor issued for the same filters and ordering"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, movie_id, fingerprint = payload["k"], int(payload["id"]), payload["f"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if fingerprint != _fingerprint(filter_key, mode):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor does not belong to this search"
+        )
+    return values, movie_id
+
+def keyset_after(keys, values, id_column, movie_id):
+    """
+    SQL condition selecting the rows after a cursor position.
+
+    keys are the sort expressions, each ordered descending with NULLs last,
+    followed by id_column ascending; values are the cursor's key values.
+    """
+    condition = id_column > movie_id
+    for key, value in reversed(list(zip(keys, values))):
+        if value is None:
+            condition = and_(key.is_(None), condition)
+        else:
+            condition = or_(key < value, key.is_(None), and_(key == value, condition))
+    return condition
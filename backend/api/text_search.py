@@ -0,0 +1,13 @@
+from sqlalchemy import func
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input only ever matches literally"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def matches_substring(column, substring: str):
+    """Case-insensitive substring filter, served by the column's pg_trgm GIN index"""
+    return column.ilike(f"%{escape_like(substring)}%", escape="\\")
+
+def relevance(column, substring: str):
+    """Trigram similarity of column to substring, higher is a closer match"""
+    return func.similarity(column, substring)
@@ -13,6 +13,7 @@ from collections import defaultdict
 #from backend.tests.minio_function import upload_single_file
 import io
 from typing import Dict
+from .text_search import matches_substring, relevance
 import time
 from pydantic import EmailStr
 from .email import *
@@ -257,11 +258,12 @@ def get_user_of_substring(substring: str, username: str, db: Session = Depends(g
     ).subquery()
 
     # Query users whose username matches and are NOT current user or a friend
+    # closest usernames first, so the 15 returned are the most relevant
     users = db.query(Users).filter(
-        Users.username.ilike(f"%{substring}%"),
+        matches_substring(Users.username, substring),
         Users.username != username,
         ~Users.user_id.in_(friend_ids_subquery)
-    ).limit(15).all()
+    ).order_by(relevance(Users.username, substring).desc(), Users.user_id).limit(15).all()
 
     if not users:
         return []
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session
 # from backend.models import *
 # from backend.pydantic_models import *
 # from backend.database import get_db
@@ -10,7 +10,9 @@ from passlib.context import CryptContext
 import jwt
 from datetime import datetime, timedelta
 from collections import defaultdict
-from .recommendations import get_recommendation_eng_movies
+from .recommendations import get_recommendation_eng_movies, invalidate_watchlist_recommendations
+from .text_search import matches_substring, relevance
+from .movie_cards import get_movie_cards
 router = APIRouter(prefix="/watchlist", tags=["watchlist"])
 
 
@@ -146,6 +148,7 @@ def add_movie(input: MoviesInWatchListCreate, db: Session = Depends(get_db)):
     db.add(db_MIW)
     watchlist.number_of_movies += 1
     db.commit()
+    invalidate_watchlist_recommendations(input.watchlist_id)
     return db_MIW    
 
 @router.delete("/delete_movie/{user_id}/{watchlist_id}/{movie_id}/{access_token}", status_code=status.HTTP_204_NO_CONTENT)
@@ -194,6 +197,7 @@ def delete_movie(user_id: int, watchlist_id: int, movie_id: int,access_token: st
     db.delete(IsMovieInWatchList)
     watchlist.number_of_movies -= 1
     db.commit()
+    invalidate_watchlist_recommendations(watchlist_id)
     return
 
 @router.delete("/delete/{watchlist_id}/{access_token}", status_code=status.HTTP_204_NO_CONTENT)
@@ -233,36 +237,12 @@ def Get_All_Movies_In_WatchList(watchlist_id: int, db: Session = Depends(get_db)
     moviesInWatchListID = db.query(MoviesInWatchList).filter(MoviesInWatchList.watchlist_id == watchlist_id).all()
     movie_ids = [entry.movie_id for entry in moviesInWatchListID]
 
-    movies = (
-        db.query(Movie)
-        .options(
-            joinedload(Movie.genres),
-            joinedload(Movie.actors),
-            joinedload(Movie.directors)
-        )
-        .filter(Movie.movie_id.in_(movie_ids))
-        .all()
-    )
+    movies = get_movie_cards(db, movie_ids)
 
     if not movies:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="No movies were found")
 
-    movies_data = []
-    for movie in movies:
-        movies_data.append(
-            MovieResponse(
-                title=movie.title,
-                description=movie.description,
-                movie_length=movie.movie_length,
-                rating=movie.rating,
-                image_url=movie.image_url,
-                movie_id=movie.movie_id,
-                release_date=movie.release_date,
-                director=movie.directors[0].director_name if movie.directors else None,
-                genres=[genre.genre_name for genre in movie.genres],
-                actors=[actor.actor_name for actor in movie.actors]
-            )
-        )
+    movies_data = [MovieResponse(**card) for card in movies]
 
     return AllMoviesInWatchResponse(movies=movies_data)
 
@@ -439,9 +419,9 @@ def remove_guest_from_watchlist(watchlist_id: int, user_id: int,access_token:str
 @router.get("/search/{substring}/{user_id}", response_model=AllWatchListResponse, status_code=status.HTTP_200_OK)
 def search_watchlists(substring: str, user_id: int, db: Session = Depends(get_db)):
     watchlists = db.query(WatchList).filter(
-        WatchList.watchlist_title.ilike(f"%{substring}%"),
+        matches_substring(WatchList.watchlist_title, substring),
         WatchList.owner != user_id
-    ).all()
+    ).order_by(relevance(WatchList.watchlist_title, substring).desc(), WatchList.watchlist_id).all()
     
     if not watchlists:
         raise HTTPException(status_code=204, detail="No public watchlists found matching the search criteria.")
@@ -35,6 +35,35 @@ def get_db():
     finally:
         db.close()
 
+# create_all only creates missing tables, so columns and indexes added to existing
+# tables after the first release are applied here; every statement is idempotent
+SCHEMA_UPGRADES = [
+    "ALTER TABLE movie ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS idx_movie_updated_at ON movie (updated_at)",
+    "ALTER TABLE movie ADD COLUMN IF NOT EXISTS tmdb_id INTEGER",
+    "ALTER TABLE movie ADD COLUMN IF NOT EXISTS last_synced_at TIMESTAMP WITHOUT TIME ZONE",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_movie_tmdb_id ON movie (tmdb_id)",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS idx_movie_title_trgm ON movie USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_watchlist_title_trgm ON watchlist USING gin (watchlist_title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    # genres, actors and director of every movie pre-aggregated, so reads never join the
+    # three relation tables (one row per genre x actor x director) to build a movie card;
+    # each card records its movie's updated_at so readers can tell when it is stale
+    """CREATE MATERIALIZED VIEW IF NOT EXISTS movie_card AS
+    SELECT movie.movie_id,
+        coalesce((SELECT array_agg(genre_name ORDER BY genre_name) FROM genrestomovie
+                  WHERE genrestomovie.movie_id = movie.movie_id), '{}') AS genres,
+        coalesce((SELECT array_agg(actor_name ORDER BY actor_name) FROM actortomovie
+                  WHERE actortomovie.movie_id = movie.movie_id), '{}') AS actors,
+        (SELECT director_name FROM directortomovie
+         WHERE directortomovie.movie_id = movie.movie_id ORDER BY director_name LIMIT 1) AS director,
+        movie.updated_at
+    FROM movie""",
+    # REFRESH ... CONCURRENTLY needs a unique index
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_movie_card_movie_id ON movie_card (movie_id)",
+]
+
 async def initialize_database():    
     # Initialize with async engine
     async with async_engine.begin() as conn:
@@ -43,6 +72,8 @@ async def initialize_database():
     # Initialize with sync engine
     with sync_engine.begin() as conn:
         Base.metadata.create_all(conn)
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
     logging.info("✅ Database initialized with sync engine.")
 async def update_expired_keys():
     """Update expired keys every 60 seconds."""
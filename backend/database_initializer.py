@@ -1,6 +1,7 @@
 import requests
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from models import Movie, GenresToMovie, DirectorToMovie, ActorToMovie
+from models import Movie
 from database import get_db, initialize_database
 import os
 from dotenv import load_dotenv
@@ -8,6 +9,9 @@ from datetime import datetime
 import time
 from typing import List, Dict, Set
 import logging
+from tmdb_ingest import AsyncTMDBClient, AsyncIngestionPipeline, IngestionCheckpoint
+from tmdb_cache import get_response_cache
+from movie_writer import MovieBatchWriter, refresh_movie_cards, unstored_movies
 
 load_dotenv()
 
@@ -23,6 +27,10 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+# overridable so ingestion can run against a local stub server
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+# where a running backfill records its position so a restart can resume it
+INIT_CHECKPOINT_PATH = os.getenv("INIT_CHECKPOINT_PATH", "database_init_checkpoint.json")
 
 class DatabaseInitializer:
     def __init__(self):
@@ -30,9 +38,10 @@ class DatabaseInitializer:
             raise ValueError("TMDB_API_KEY not found in environment variables")
         
         self.api_key = TMDB_API_KEY
-        self.base_url = "https://api.themoviedb.org/3"
+        self.base_url = TMDB_BASE_URL
         self.session = requests.Session()
         self.processed_movies = set()
+        self.checkpoint = IngestionCheckpoint(INIT_CHECKPOINT_PATH)
         
     def make_request(self, url: str, params: dict = None, retries: int = 3) -> dict:
         """Make API request with retry logic and rate limiting"""
@@ -41,6 +50,12 @@ class DatabaseInitializer:
         
         params["api_key"] = self.api_key
         params["language"] = "en-US"
+
+        cache = get_response_cache()
+        if cache is not None:
+            cached = cache.get(url, params)
+            if cached is not None:
+                return cached
         
         for attempt in range(retries):
             try:
@@ -48,7 +63,10 @@ class DatabaseInitializer:
                 response.raise_for_status()
                 time.sleep(0.25) 
                 
-                return response.json()
+                data = response.json()
+                if cache is not None:
+                    cache.set(url, params, data)
+                return data
                 
             except requests.exceptions.RequestException as e:
                 logger.warning(f"Request failed (attempt {attempt + 1}/{retries}): {e}")
@@ -88,206 +106,34 @@ class DatabaseInitializer:
         
         return movies
     
-    def fetch_top_rated_movies_by_year(self, year: int, max_pages: int = 5) -> List[Dict]:
-        """Fetch top-rated movies for a specific year"""
-        movies = []
-        
-        for page in range(1, max_pages + 1):
-            try:
-                url = f"{self.base_url}/discover/movie"
-                params = {
-                    "primary_release_year": year,
-                    "sort_by": "vote_average.desc",
-                    "page": page,
-                    "vote_count.gte": 10,  
-                    "vote_average.gte": 3.0 
-                }
-                
-                data = self.make_request(url, params)
-                
-                if not data.get("results"):
-                    break
-                    
-                movies.extend(data["results"])
-            
-                if page % 2 == 0:
-                    logger.info(f"Fetched page {page} top-rated for year {year} - {len(movies)} movies so far")
-                    
-            except Exception as e:
-                logger.error(f"Error fetching top-rated movies for year {year}, page {page}: {e}")
-                break
-        
-        return movies
-    
     def fetch_movie_details(self, movie_id: int) -> dict:
-        """Fetch detailed information for a specific movie"""
+        """Fetch detailed information for a specific movie, with its credits under "credits" """
         try:
             url = f"{self.base_url}/movie/{movie_id}"
-            return self.make_request(url)
+            # one request instead of separate details and /credits calls
+            return self.make_request(url, {"append_to_response": "credits"})
         except Exception as e:
             logger.error(f"Error fetching details for movie ID {movie_id}: {e}")
             return None
     
-    def fetch_movie_credits(self, movie_id: int) -> dict:
-        """Fetch credits (cast and crew) for a specific movie"""
-        try:
-            url = f"{self.base_url}/movie/{movie_id}/credits"
-            return self.make_request(url)
-        except Exception as e:
-            logger.error(f"Error fetching credits for movie ID {movie_id}: {e}")
-            return None
-    
-    def get_director_from_credits(self, credits: dict) -> str:
-        """Extract director name from credits"""
-        if not credits:
-            return None
-            
-        for person in credits.get("crew", []):
-            if person.get("job") == "Director":
-                return person.get("name")
-        return None
-    
-    def get_actors_from_credits(self, credits: dict, max_actors: int = 5) -> List[str]:
-        """Extract actor names from credits"""
-        if not credits:
-            return []
-            
-        actors = []
-        for person in credits.get("cast", [])[:max_actors]:
-            if person.get("name"):
-                actors.append(person.get("name"))
-        return actors
-    
-    def save_movie_to_db(self, movie_data: dict, db: Session) -> bool:
-        """Save a movie and its related data to the database"""
-        try:
-            movie_id = movie_data.get("id")
-            title = movie_data.get("title")
-            
-            if not movie_id or not title:
-                return False
-            
-            # Check if movie already exists
-            existing_movie = db.query(Movie).filter(Movie.title == title).first()
-            if existing_movie:
-                logger.debug(f"Movie '{title}' already exists, skipping")
-                return False
-            
-            # Get detailed movie information
-            movie_details = self.fetch_movie_details(movie_id)
-            if not movie_details:
-                return False
-            
-            # Parse release date
-            release_date_str = movie_details.get("release_date")
-            try:
-                release_date = datetime.strptime(release_date_str, "%Y-%m-%d") if release_date_str else None
-            except ValueError:
-                release_date = None
-            
-            # Create movie record
-            new_movie = Movie(
-                title=title,
-                description=movie_details.get("overview"),
-                movie_length=movie_details.get("runtime") or 120,
-                rating=movie_details.get("vote_average"),
-                image_url=f"https://image.tmdb.org/t/p/w500{movie_details.get('poster_path')}" if movie_details.get("poster_path") else None,
-                release_date=release_date
-            )
-            
-            db.add(new_movie)
-            db.commit()
-            db.refresh(new_movie)
-            
-            # Add genres
-            genres = movie_details.get("genres", [])
-            for genre in genres:
-                genre_name = genre.get("name")
-                if genre_name:
-                    genre_to_movie = GenresToMovie(
-                        movie_id=new_movie.movie_id, 
-                        genre_name=genre_name
-                    )
-                    db.add(genre_to_movie)
-            
-            # Get and add credits
-            credits = self.fetch_movie_credits(movie_id)
-            
-            # Add director
-            director_name = self.get_director_from_credits(credits)
-            if director_name:
-                director_to_movie = DirectorToMovie(
-                    movie_id=new_movie.movie_id,
-                    director_name=director_name
-                )
-                db.add(director_to_movie)
-            
-            # Add actors
-            actor_names = self.get_actors_from_credits(credits)
-            for actor_name in actor_names:
-                actor_to_movie = ActorToMovie(
-                    movie_id=new_movie.movie_id,
-                    actor_name=actor_name
-                )
-                db.add(actor_to_movie)
-            
-            db.commit()
-            logger.info(f"Successfully added movie: '{title}' ({release_date_str})")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error saving movie '{title}': {e}")
-            db.rollback()
-            return False
-    
-    def initialize_database_1980_present(self, db: Session):
-        """Initialize database with movies from 1980 to present"""
-        current_year = datetime.now().year
-        start_year = 1970
-        
-        total_movies_added = 0
-        total_movies_processed = 0
-        
-        logger.info(f"Starting database initialization from {start_year} to {current_year}")
-        logger.info("This process may take several hours due to API rate limits...")
-        
-        for year in range(start_year, current_year + 1):
-            year_start_time = time.time()
-            year_movies_added = 0
-            
-            logger.info(f"\n=== Processing year {year} ===")
-            
-            logger.info(f"Fetching popular movies for {year}...")
-            popular_movies = self.fetch_popular_movies_by_year(year)
-            
-            logger.info(f"Fetching top-rated movies for {year}...")
-            top_rated_movies = self.fetch_top_rated_movies_by_year(year)
-            
-            all_movies = {movie["id"]: movie for movie in popular_movies + top_rated_movies}
-            unique_movies = list(all_movies.values())
-            
-            logger.info(f"Found {len(unique_movies)} unique movies for {year}")
-            
-            for movie_data in unique_movies:
-                total_movies_processed += 1
-                
-                if self.save_movie_to_db(movie_data, db):
-                    total_movies_added += 1
-                    year_movies_added += 1
-                
-                if total_movies_processed % 10 == 0:
-                    logger.info(f"Progress: {total_movies_processed} movies processed, {total_movies_added} added")
-            
-            year_duration = time.time() - year_start_time
-            logger.info(f"Year {year} completed: {year_movies_added} movies added in {year_duration:.1f} seconds")
-            
-            time.sleep(1)
-        
-        logger.info(f"\n=== Database Initialization Complete ===")
-        logger.info(f"Total movies processed: {total_movies_processed}")
-        logger.info(f"Total movies added: {total_movies_added}")
-        logger.info(f"Years covered: {start_year} to {current_year}")
-    
+    def load_ingested_ids(self, db: Session):
+        """Seed processed_movies with every TMDB id already in the database"""
+        result = db.execute(
+            select(Movie.tmdb_id).where(Movie.tmdb_id.isnot(None)),
+            execution_options={"stream_results": True, "yield_per": 10000},
+        )
+        for rows in result.partitions():
+            self.processed_movies.update(tmdb_id for (tmdb_id,) in rows)
+        logger.info(f"Loaded {len(self.processed_movies)} already ingested TMDB ids")
+
+    async def initialize_database_concurrent(self, db: Session, start_year: int = 1970, end_year: int = None):
+        """Initialize database from start_year to end_year with the concurrent ingestion pipeline"""
+        end_year = end_year or datetime.now().year
+        async with AsyncTMDBClient(self.api_key, base_url=self.base_url) as client:
+            self.load_ingested_ids(db)
+            pipeline = AsyncIngestionPipeline(client, self, db, checkpoint=self.checkpoint)
+            await pipeline.run(start_year, end_year)
+
     def initialize_database_quick(self, db: Session, max_movies_per_year: int = 1000):
         """Quick initialization with limited movies per year (for testing)"""
         current_year = datetime.now().year
@@ -305,16 +151,20 @@ class DatabaseInitializer:
             
             # Limit movies per year
             movies = movies[:max_movies_per_year]
+            movies = unstored_movies(db, [movie for movie in movies if movie.get("id") and movie.get("title")])
             
-            year_added = 0
-            for movie_data in movies:
-                if self.save_movie_to_db(movie_data, db):
-                    year_added += 1
-                    total_added += 1
+            with MovieBatchWriter(db) as writer:
+                for movie_data in movies:
+                    movie_details = self.fetch_movie_details(movie_data["id"])
+                    if movie_details:
+                        writer.add(movie_details, movie_details.get("credits"))
+            year_added = writer.added
+            total_added += year_added
             
             logger.info(f"Year {year}: {year_added} movies added")
         
         logger.info(f"Quick initialization complete: {total_added} movies added")
+        refresh_movie_cards(db)
 
 async def run_full_initialization():
     """Run full database initialization"""
@@ -327,7 +177,7 @@ async def run_full_initialization():
     db = next(get_db())
     
     try:
-        initializer.initialize_database_1980_present(db)
+        await initializer.initialize_database_concurrent(db)
     except KeyboardInterrupt:
         logger.info("Initialization interrupted by user")
     except Exception as e:
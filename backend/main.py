@@ -12,6 +12,9 @@ from api.movie import router as movie_router
 from api.recommendations import router as recommendation_router
 #from backend.tests.minio_function import router as minio_router
 from api.cached_data import periodic_refresh
+from api.collaborative_model import periodic_model_training
+from api.movie import periodic_landing_refresh
+from api.recommendations import recommendation_executor
 
 async def lifespan(app: FastAPI):
     print("Starting DB initialization")
@@ -19,6 +22,8 @@ async def lifespan(app: FastAPI):
     print("DB initialized, starting background tasks")
     key_task = asyncio.create_task(update_expired_keys())
     cache_task = asyncio.create_task(periodic_refresh(10))
+    model_task = asyncio.create_task(periodic_model_training(60))
+    landing_task = asyncio.create_task(periodic_landing_refresh(60))
 
     print("Background tasks started")
     try:
@@ -27,7 +32,10 @@ async def lifespan(app: FastAPI):
         print("Lifespan shutdown: cancelling background tasks")
         key_task.cancel()
         cache_task.cancel()
-        await asyncio.gather(key_task, cache_task, return_exceptions=True)
+        model_task.cancel()
+        landing_task.cancel()
+        await asyncio.gather(key_task, cache_task, model_task, landing_task, return_exceptions=True)
+        recommendation_executor.shutdown()
         print("Background tasks cancelled")
 
 
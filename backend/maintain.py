@@ -4,6 +4,7 @@ import logging
 from datetime import datetime, timedelta
 from threading import Thread
 import os
+import json
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from database import get_db, initialize_database
@@ -17,7 +18,7 @@ try:
         populate_movies, 
         # update_all_movies, 
         # fetch_movies_by_date_range,
-        update_movie_info
+        update_changed_movies
     )
 except ImportError:
     print("Warning: Could not import movie_populator functions. Make sure the file exists.")
@@ -35,6 +36,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# TMDB's changes feed serves at most 14 days, older changes cannot be read back
+CHANGES_WINDOW_DAYS = 14
+# start time of the last weekly update that read the whole changes feed
+CHANGES_WATERMARK_PATH = os.getenv("CHANGES_WATERMARK_PATH", "changes_watermark.json")
+
+def load_changes_watermark() -> Optional[datetime]:
+    """Start of the last successful weekly update, None before the first one"""
+    if not os.path.exists(CHANGES_WATERMARK_PATH):
+        return None
+    try:
+        with open(CHANGES_WATERMARK_PATH) as f:
+            return datetime.fromisoformat(json.load(f)["synced_at"])
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Ignoring unreadable watermark {CHANGES_WATERMARK_PATH}: {e}")
+        return None
+
+def save_changes_watermark(synced_at: datetime):
+    # write next to the target and rename so a crash never leaves a truncated watermark
+    tmp_path = f"{CHANGES_WATERMARK_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"synced_at": synced_at.isoformat()}, f)
+    os.replace(tmp_path, CHANGES_WATERMARK_PATH)
+
 class MovieMaintenance:
     def __init__(self):
         self.tmdb_api_key = os.getenv("TMDB_API_KEY")
@@ -46,31 +70,22 @@ class MovieMaintenance:
         return next(get_db())
     
     def weekly_movie_update(self):
-        """Update existing movies with latest information from TMDB"""
+        """Update existing movies that changed on TMDB since the last weekly run"""
         logger.info("Starting weekly movie update task...")
         
         db = self.get_db_session()
         try:
-            # Update all existing movies
-            movies = db.query(Movie).all()
-            updated_count = 0
-            failed_count = 0
-            
-            for movie in movies:
-                try:
-                    # If you have TMDB ID stored, use it; otherwise skip
-                    if hasattr(movie, 'tmdb_id') and movie.tmdb_id:
-                        if update_movie_info(db, movie.tmdb_id):
-                            updated_count += 1
-                        else:
-                            failed_count += 1
-                    else:
-                        logger.warning(f"Movie '{movie.title}' has no TMDB ID for updating")
-                        
-                except Exception as e:
-                    logger.error(f"Error updating movie '{movie.title}': {e}")
-                    failed_count += 1
-                    continue
+            # resume from the last successful run, so a late or skipped run loses nothing
+            # unless the gap outgrows what the feed still serves
+            started_at = datetime.now()
+            oldest = started_at - timedelta(days=CHANGES_WINDOW_DAYS)
+            since = load_changes_watermark()
+            if since is None or since < oldest:
+                if since is not None:
+                    logger.warning(f"Last update ran {since:%Y-%m-%d}, changes before {oldest:%Y-%m-%d} are no longer in the feed")
+                since = oldest
+            updated_count, failed_count = update_changed_movies(db, since, started_at)
+            save_changes_watermark(started_at)
             
             logger.info(f"Weekly update completed: {updated_count} movies updated, {failed_count} failed")
             
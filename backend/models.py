@@ -1,4 +1,5 @@
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Float, Text, PrimaryKeyConstraint, Index, CheckConstraint, Enum
+from sqlalchemy import DDL, event, Table, MetaData, ARRAY
 from sqlalchemy.orm import relationship
 #from backend.main import Base
 from database import Base
@@ -6,6 +7,9 @@ from datetime import datetime
 import enum
 from datetime import datetime, timedelta
 
+# the trigram indexes below need pg_trgm before create_all builds them
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
 class Users(Base):
     __tablename__ = "users"
     user_id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
@@ -19,6 +23,10 @@ class Users(Base):
     description = Column(String(800), nullable = False, default= "")
     is_verified = Column(Boolean, nullable = False, default = False)
 
+    __table_args__ = (
+        Index('idx_users_username_trgm', 'username', postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}),
+    )
+
 
 class Verification(Base):
     __tablename__ = "verification"
@@ -43,17 +51,40 @@ class Movie(Base):
     rating = Column(Float, nullable=False)
     image_url =Column(Text)
     release_date = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+    tmdb_id = Column(Integer, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)
 
     __table_args__ = (
         CheckConstraint('movie_length > 0', name='check_movie_length'),
         CheckConstraint('rating BETWEEN 0 AND 10', name='check_rating_range'),
         Index('idx_movie_rating', 'rating'),
+        Index('idx_movie_updated_at', 'updated_at'),
+        Index('idx_movie_tmdb_id', 'tmdb_id', unique=True),
+        # trigram index so title ILIKE '%...%' and similarity() searches avoid a sequential scan
+        Index('idx_movie_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
     )
     directors = relationship("DirectorToMovie", back_populates="movie", cascade="all, delete-orphan")
     actors = relationship("ActorToMovie", back_populates="movie", cascade="all, delete-orphan")
     genres = relationship("GenresToMovie", back_populates="movie", cascade="all, delete-orphan")
 
 
+# movie_card is a materialized view created by SCHEMA_UPGRADES and rebuilt by the ingestion
+# jobs (movie_writer.refresh_movie_cards); its table lives in its own MetaData so create_all
+# never tries to create it as a plain table
+movie_card_table = Table(
+    "movie_card", MetaData(),
+    Column("movie_id", Integer, primary_key=True),
+    Column("genres", ARRAY(String)),
+    Column("actors", ARRAY(String)),
+    Column("director", String),
+    Column("updated_at", DateTime),
+)
+
+class MovieCard(Base):
+    __table__ = movie_card_table
+
+
 class DirectorToMovie(Base):
     __tablename__ = "directortomovie"
     movie_id = Column(Integer, ForeignKey("movie.movie_id", ondelete="CASCADE"), primary_key=True, nullable=False)
@@ -93,7 +124,8 @@ class WatchList(Base):
 
     __table_args__ = (
         CheckConstraint('number_of_movies >= 0', name='check_positive_movie_count'),
-        Index('idx_watchlist_owner', 'owner')
+        Index('idx_watchlist_owner', 'owner'),
+        Index('idx_watchlist_title_trgm', 'watchlist_title', postgresql_using='gin', postgresql_ops={'watchlist_title': 'gin_trgm_ops'}),
     )
 
 class MoviesInWatchList(Base):
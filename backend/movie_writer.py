@@ -0,0 +1,186 @@
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import select, update, exists, cast, values, column, text, or_, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, aliased
+from models import Movie, GenresToMovie, DirectorToMovie, ActorToMovie
+
+logger = logging.getLogger(__name__)
+
+MOVIE_BATCH_SIZE = 200
+MAX_ACTORS = 5
+
+MOVIE_COLUMNS = ("tmdb_id", "title", "description", "movie_length", "rating", "image_url", "release_date")
+# stamped by the writer itself rather than taken from the payload
+SYNC_COLUMNS = ("updated_at", "last_synced_at")
+
+def parse_movie(movie_details: dict, credits: dict = None, max_actors: int = MAX_ACTORS) -> Optional[Dict]:
+    """Turn a TMDB details payload (and its credits) into the rows the writer inserts"""
+    title = movie_details.get("title") if movie_details else None
+    if not title:
+        return None
+
+    release_date_str = movie_details.get("release_date")
+    try:
+        release_date = datetime.strptime(release_date_str, "%Y-%m-%d") if release_date_str else None
+    except ValueError:
+        release_date = None
+
+    credits = credits or {}
+    director = next((person.get("name") for person in credits.get("crew", []) if person.get("job") == "Director"), None)
+    return {
+        "movie": {
+            "tmdb_id": movie_details.get("id"),
+            "title": title,
+            "description": movie_details.get("overview") or "",
+            "movie_length": movie_details.get("runtime") or 120,
+            "rating": movie_details.get("vote_average") or 0.0,
+            "image_url": f"https://image.tmdb.org/t/p/w500{movie_details.get('poster_path')}" if movie_details.get("poster_path") else None,
+            "release_date": release_date,
+        },
+        "genres": [genre.get("name") for genre in movie_details.get("genres", []) if genre.get("name")],
+        "director": director,
+        "actors": [person.get("name") for person in credits.get("cast", [])[:max_actors] if person.get("name")],
+    }
+
+def unstored_movies(db: Session, listed: List[Dict]) -> List[Dict]:
+    """
+    The TMDB list entries (with "id" and "title") that are not in the database yet.
+
+    Checked with one query per 1000 entries before any details are fetched, by
+    tmdb_id or by title, since the insert skips any title that is already stored.
+    """
+    fresh = []
+    for start in range(0, len(listed), 1000):
+        chunk = listed[start:start + 1000]
+        stored = db.query(Movie.tmdb_id, Movie.title).filter(or_(
+            Movie.tmdb_id.in_([entry["id"] for entry in chunk]),
+            Movie.title.in_([entry["title"] for entry in chunk]),
+        )).all()
+        stored_ids = {tmdb_id for tmdb_id, _ in stored if tmdb_id is not None}
+        stored_titles = {title for _, title in stored}
+        fresh.extend(entry for entry in chunk if entry["id"] not in stored_ids and entry["title"] not in stored_titles)
+    return fresh
+
+def _insert_movies(db: Session, parsed: List[Dict]) -> int:
+    # first occurrence of a title wins, later ones in the same batch are duplicates
+    by_title = {}
+    for entry in parsed:
+        by_title.setdefault(entry["movie"]["title"], entry)
+    now = datetime.now()
+
+    columns = MOVIE_COLUMNS + SYNC_COLUMNS
+    incoming = values(
+        *(column(name, Movie.__table__.c[name].type) for name in columns),
+        name="incoming",
+    ).data([tuple(entry["movie"][name] for name in MOVIE_COLUMNS) + (now, now) for entry in by_title.values()])
+    # a VALUES column that is NULL in every row comes back as text, so cast to the table's types
+    typed = {name: cast(incoming.c[name], Movie.__table__.c[name].type) for name in columns}
+
+    # rows saved before tmdb_id existed are matched by title and given their id; a legacy
+    # catalogue can hold the same title several times, only its lowest movie_id is tagged,
+    # and never with an id another row already carries, so idx_movie_tmdb_id holds
+    untagged = aliased(Movie)
+    tagged = aliased(Movie)
+    first_untagged = (
+        select(func.min(untagged.movie_id))
+        .where(untagged.title == incoming.c.title, untagged.tmdb_id.is_(None))
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Movie)
+        .where(
+            Movie.title == incoming.c.title,
+            Movie.tmdb_id.is_(None),
+            incoming.c.tmdb_id.isnot(None),
+            Movie.movie_id == first_untagged,
+            ~exists().where(tagged.tmdb_id == typed["tmdb_id"]),
+        )
+        .values(tmdb_id=typed["tmdb_id"], last_synced_at=typed["last_synced_at"])
+    )
+
+    # duplicates are filtered out by the database, not by a query per movie
+    new_rows = select(*typed.values()).where(~exists().where(Movie.title == incoming.c.title))
+    inserted = db.execute(
+        insert(Movie)
+        .from_select(list(columns), new_rows)
+        .on_conflict_do_nothing(index_elements=["tmdb_id"])
+        .returning(Movie.movie_id, Movie.title)
+    ).all()
+
+    genres, directors, actors = [], [], []
+    for movie_id, title in inserted:
+        entry = by_title[title]
+        genres.extend({"movie_id": movie_id, "genre_name": name} for name in dict.fromkeys(entry["genres"]))
+        if entry["director"]:
+            directors.append({"movie_id": movie_id, "director_name": entry["director"]})
+        actors.extend({"movie_id": movie_id, "actor_name": name} for name in dict.fromkeys(entry["actors"]))
+
+    for model, rows in ((GenresToMovie, genres), (DirectorToMovie, directors), (ActorToMovie, actors)):
+        if rows:
+            db.execute(insert(model).values(rows).on_conflict_do_nothing())
+    return len(inserted)
+
+def write_movies(db: Session, parsed: List[Dict]) -> int:
+    """
+    Insert parsed movies and their genre/director/actor rows in one transaction.
+
+    Returns how many movies were new. If the batch fails it is retried one
+    movie at a time, so a single bad row only loses that movie.
+    """
+    parsed = [entry for entry in parsed if entry]
+    if not parsed:
+        return 0
+    try:
+        added = _insert_movies(db, parsed)
+        db.commit()
+        return added
+    except Exception as e:
+        db.rollback()
+        if len(parsed) == 1:
+            logger.error(f"Error saving movie '{parsed[0]['movie']['title']}': {e}")
+            return 0
+        logger.warning(f"Batch of {len(parsed)} movies failed, retrying one by one: {e}")
+        return sum(write_movies(db, [entry]) for entry in parsed)
+
+class MovieBatchWriter:
+    """
+    Buffers parsed movies and writes them batch_size at a time with write_movies.
+
+    Call flush() (or use it as a context manager) to write whatever is left.
+    """
+    def __init__(self, db: Session, batch_size: int = MOVIE_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffer = []
+        self.added = 0
+
+    def add(self, movie_details: dict, credits: dict = None) -> int:
+        """Queue a movie, returns how many movies were written if this filled a batch"""
+        entry = parse_movie(movie_details, credits)
+        if entry is not None:
+            self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        batch, self.buffer = self.buffer, []
+        added = write_movies(self.db, batch)
+        self.added += added
+        return added
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+def refresh_movie_cards(db: Session):
+    """Rebuild the movie_card view after an ingestion job; CONCURRENTLY keeps it readable meanwhile"""
+    start = time.time()
+    db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY movie_card"))
+    db.commit()
+    logger.info(f"✅ Refreshed movie cards in {time.time() - start:.1f}s")
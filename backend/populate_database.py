@@ -1,10 +1,18 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlalchemy.orm import Session,query
-from models import Movie, GenresToMovie, DirectorToMovie, ActorToMovie
+from models import Movie
+from movie_writer import MovieBatchWriter, refresh_movie_cards, unstored_movies
+from tmdb_cache import get_response_cache
+from tmdb_ingest import TMDB_REQUESTS_PER_SECOND
 from database import get_db, initialize_database
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
 from typing import Optional, Tuple
 
 load_dotenv()
@@ -15,53 +23,160 @@ TMDB_API_URLS = [
     "https://api.themoviedb.org/3/movie/now_playing",
     "https://api.themoviedb.org/3/movie/upcoming"
 ]
+TMDB_DISCOVER_URL = "https://api.themoviedb.org/3/discover/movie"
+# list endpoints that discover can reproduce with a server-side date filter, and the
+# discover parameters that reproduce them; top rated only counts well-voted movies
+TMDB_DISCOVER_EQUIVALENTS = {
+    "https://api.themoviedb.org/3/movie/top_rated": {"sort_by": "vote_average.desc", "vote_count.gte": 200},
+    "https://api.themoviedb.org/3/movie/popular": {"sort_by": "popularity.desc"},
+}
+# TMDB rejects page numbers above 500
+TMDB_MAX_PAGES = 500
+TMDB_PAGE_WORKERS = 8
+
+def create_tmdb_session() -> requests.Session:
+    """Session with pooled keep-alive connections that retries throttled and failed GETs with backoff"""
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# shared by every fetcher so each request reuses an open connection instead of a new TCP+TLS handshake
+tmdb_session = create_tmdb_session()
+_rate_limit = {"next_request_at": 0.0}
+_rate_limit_lock = threading.Lock()
+
+def wait_for_rate_limit():
+    """Space requests at least 1/TMDB_REQUESTS_PER_SECOND apart across all threads"""
+    with _rate_limit_lock:
+        now = time.monotonic()
+        wait = _rate_limit["next_request_at"] - now
+        _rate_limit["next_request_at"] = max(now, _rate_limit["next_request_at"]) + 1 / TMDB_REQUESTS_PER_SECOND
+    if wait > 0:
+        time.sleep(wait)
+
+def tmdb_get(url: str, params: dict, refresh: bool = False) -> dict:
+    """
+    GET a TMDB endpoint and return its JSON, served from the response cache when one is configured
+
+    With refresh the cached copy is skipped and replaced by the fresh response.
+    """
+    cache = get_response_cache()
+    if cache is not None and not refresh:
+        cached = cache.get(url, params)
+        if cached is not None:
+            return cached
+    wait_for_rate_limit()
+    response = tmdb_session.get(url, params=params, timeout=30)
+    response.raise_for_status()
+    data = response.json()
+    if cache is not None:
+        cache.set(url, params, data)
+    return data
+
+def fetch_page_results(url: str, params: dict, page: int) -> Optional[list]:
+    """Results of one page of a TMDB listing, None if the request failed"""
+    try:
+        return tmdb_get(url, {**params, "page": page}).get("results", [])
+    except requests.RequestException as e:
+        print(f"Error fetching page {page} from {url}: {e}")
+        return None
+
+def fetch_result_pages(url: str, params: dict, first_page: Optional[dict] = None) -> list:
+    """
+    Fetch every page of a paginated TMDB listing
+
+    The page set is planned from total_pages on the first response, and the
+    remaining pages are fetched TMDB_PAGE_WORKERS at a time. Fetching stops
+    after a wave that hit an empty or failed page.
+
+    Args:
+        url: Listing endpoint
+        params: Query parameters without the page number
+        first_page: Already fetched response for page 1 (optional)
+    """
+    if first_page is None:
+        try:
+            first_page = tmdb_get(url, {**params, "page": 1})
+        except requests.RequestException as e:
+            print(f"Error fetching page 1 from {url}: {e}")
+            return []
+    results = list(first_page.get("results", []))
+    last_page = min(first_page.get("total_pages", 1), TMDB_MAX_PAGES)
+
+    pages = list(range(2, last_page + 1))
+    with ThreadPoolExecutor(max_workers=TMDB_PAGE_WORKERS) as pool:
+        for wave_start in range(0, len(pages), TMDB_PAGE_WORKERS):
+            wave = pages[wave_start:wave_start + TMDB_PAGE_WORKERS]
+            wave_results = list(pool.map(lambda page: fetch_page_results(url, params, page), wave))
+            for page_results in wave_results:
+                results.extend(page_results or [])
+            if not all(wave_results):
+                break
+    return results
+
+def in_date_window(release_date: Optional[str], start_date: Optional[str], end_date: Optional[str]) -> bool:
+    if not release_date:
+        return True
+    if start_date and release_date < start_date:
+        return False
+    if end_date and release_date > end_date:
+        return False
+    return True
 
 def fetch_movies_from_tmdb(start_date: Optional[str] = None, end_date: Optional[str] = None):
     """
     Fetch movies from TMDB API with optional date range filtering
+
+    With a date range, the popular and top-rated lists are requested through
+    the discover endpoint with the same ordering, so TMDB filters by date
+    and only returns the pages in range. Now playing and upcoming are skipped
+    when the dates window they report does not overlap the range.
     
     Args:
         start_date: Start date in YYYY-MM-DD format (optional)
         end_date: End date in YYYY-MM-DD format (optional)
     """
     movies = {}
+    date_filtered = bool(start_date or end_date)
 
     for url in TMDB_API_URLS:
-        for page in range(1, 500):  
+        params = {"api_key": TMDB_API_KEY, "language": "en-US"}
+        first_page = None
+
+        if date_filtered and url in TMDB_DISCOVER_EQUIVALENTS:
+            params.update(TMDB_DISCOVER_EQUIVALENTS[url])
+            if start_date:
+                params["primary_release_date.gte"] = start_date
+            if end_date:
+                params["primary_release_date.lte"] = end_date
+            url = TMDB_DISCOVER_URL
+        elif date_filtered:
             try:
-                params = {
-                    "api_key": TMDB_API_KEY, 
-                    "language": "en-US", 
-                    "page": page
-                }
-                
-                # Add date filters if using discover endpoint
-                if "discover" in url:
-                    if start_date:
-                        params["primary_release_date.gte"] = start_date
-                    if end_date:
-                        params["primary_release_date.lte"] = end_date
-                
-                response = requests.get(url, params=params)
-                response.raise_for_status()
-                movies_data = response.json()
-                
-                for movie in movies_data.get("results", []):
-                    # Apply date filtering for non-discover endpoints
-                    if start_date or end_date:
-                        release_date = movie.get("release_date")
-                        if release_date:
-                            if start_date and release_date < start_date:
-                                continue
-                            if end_date and release_date > end_date:
-                                continue
-                    
-                    movies[movie["id"]] = movie  
-                    print(f"Found movie: {movie.get('title')} ({movie.get('release_date')})")
-                
+                first_page = tmdb_get(url, {**params, "page": 1})
             except requests.RequestException as e:
-                print(f"Error fetching page {page} from TMDb: {e}")
-                break 
+                print(f"Error fetching page 1 from {url}: {e}")
+                continue
+            dates = first_page.get("dates") or {}
+            if (end_date and dates.get("minimum") and dates["minimum"] > end_date) or \
+                    (start_date and dates.get("maximum") and dates["maximum"] < start_date):
+                print(f"Skipping {url}: its {dates['minimum']} to {dates['maximum']} window is outside the range")
+                continue
+
+        for movie in fetch_result_pages(url, params, first_page):
+            # Apply date filtering for non-discover endpoints
+            if date_filtered and not in_date_window(movie.get("release_date"), start_date, end_date):
+                continue
+            movies[movie["id"]] = movie
+            print(f"Found movie: {movie.get('title')} ({movie.get('release_date')})")
                 
     return list(movies.values())
 
@@ -74,90 +189,81 @@ def fetch_movies_by_date_range(start_date: str, end_date: str):
         end_date: End date in YYYY-MM-DD format
     """
     movies = {}
-    discover_url = "https://api.themoviedb.org/3/discover/movie"
-    
-    for page in range(1, 500):
-        try:
-            params = {
-                "api_key": TMDB_API_KEY,
-                "language": "en-US",
-                "page": page,
-                "primary_release_date.gte": start_date,
-                "primary_release_date.lte": end_date,
-                "sort_by": "popularity.desc"
-            }
-            
-            response = requests.get(discover_url, params=params)
-            response.raise_for_status()
-            movies_data = response.json()
-            
-            if not movies_data.get("results"):
-                break
-                
-            for movie in movies_data.get("results", []):
-                movies[movie["id"]] = movie
-                print(f"Found movie: {movie.get('title')} ({movie.get('release_date')})")
-                
-        except requests.RequestException as e:
-            print(f"Error fetching page {page} from TMDb discover: {e}")
-            break
+    params = {
+        "api_key": TMDB_API_KEY,
+        "language": "en-US",
+        "primary_release_date.gte": start_date,
+        "primary_release_date.lte": end_date,
+        "sort_by": "popularity.desc"
+    }
+
+    for movie in fetch_result_pages(TMDB_DISCOVER_URL, params):
+        movies[movie["id"]] = movie
+        print(f"Found movie: {movie.get('title')} ({movie.get('release_date')})")
             
     return list(movies.values())
 
-def fetch_movie_details(movie_id):
+def fetch_movie_details(movie_id, refresh: bool = False):
+    """Fetch a movie's details with its credits appended under "credits", in a single request"""
     url = f"https://api.themoviedb.org/3/movie/{movie_id}"
     try:
-        response = requests.get(url, params={"api_key": TMDB_API_KEY, "language": "en-US"})
-        response.raise_for_status()
-        return response.json()
+        return tmdb_get(url, {"api_key": TMDB_API_KEY, "language": "en-US", "append_to_response": "credits"}, refresh=refresh)
     except requests.RequestException as e:
         print(f"Error fetching details for movie ID {movie_id}: {e}")
         return None
 
-def fetch_director_name(movie_id):
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}/credits"
-    try:
-        response = requests.get(url, params={"api_key": TMDB_API_KEY})
-        response.raise_for_status()
-        credits = response.json()
-        for person in credits.get("crew", []):
-            if person.get("job") == "Director":
-                return person.get("name")
-    except requests.RequestException as e:
-        print(f"Error fetching director for movie ID {movie_id}: {e}")
-    return None
+def fetch_changed_movie_ids(start_date: str, end_date: str):
+    """
+    Fetch the TMDB ids of every movie changed between two dates from the changes feed
 
-def fetch_actor_names(movie_id, max_actors=5):
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}/credits"
-    try:
-        response = requests.get(url, params={"api_key": TMDB_API_KEY})
-        response.raise_for_status()
-        credits = response.json()
-        actor_names = [person.get("name") for person in credits.get("cast", [])[:max_actors]]
-        return actor_names
-    except requests.RequestException as e:
-        print(f"Error fetching actors for movie ID {movie_id}: {e}")
-        return []
+    Raises the request error when a page fails, a partial list would silently
+    drop the changes on the missing pages.
+
+    Args:
+        start_date: Start date in YYYY-MM-DD format, at most 14 days before end_date
+        end_date: End date in YYYY-MM-DD format
+    """
+    changed_ids = set()
+    url = "https://api.themoviedb.org/3/movie/changes"
+    page = 1
+    total_pages = 1
+    while page <= total_pages:
+        try:
+            changes = tmdb_get(url, {
+                "api_key": TMDB_API_KEY,
+                "start_date": start_date,
+                "end_date": end_date,
+                "page": page
+            }, refresh=True)
+        except requests.RequestException as e:
+            print(f"Error fetching page {page} of the TMDb changes feed: {e}")
+            raise
+        changed_ids.update(change["id"] for change in changes.get("results", []) if change.get("id"))
+        total_pages = changes.get("total_pages", 1)
+        page += 1
+    return changed_ids
 
-def update_movie_info(db: Session, movie_id: int):
+def update_movie_info(db: Session, tmdb_id: int):
     """
     Update existing movie information from TMDB
+
+    The details are always fetched fresh, a cached copy may predate the change.
     
     Args:
         db: Database session
-        movie_id: TMDB movie ID
+        tmdb_id: TMDB movie ID
     """
     try:
         # Find existing movie in database
-        existing_movie = db.query(Movie).filter(Movie.movie_id == movie_id).first()
+        existing_movie = db.query(Movie).filter(Movie.tmdb_id == tmdb_id).first()
         if not existing_movie:
-            print(f"Movie with TMDB ID {movie_id} not found in database")
+            print(f"Movie with TMDB ID {tmdb_id} not found in database")
             return False
         
         # Fetch updated details from TMDB
-        movie_details = fetch_movie_details(movie_id)
+        movie_details = fetch_movie_details(tmdb_id, refresh=True)
         if not movie_details:
-            print(f"Could not fetch updated details for movie ID {movie_id}")
+            print(f"Could not fetch updated details for movie ID {tmdb_id}")
             return False
         
         # Update movie fields
@@ -167,6 +273,7 @@ def update_movie_info(db: Session, movie_id: int):
         existing_movie.rating = new_rating
         existing_movie.description = movie_details.get("overview")
         existing_movie.movie_length = movie_details.get("runtime") or existing_movie.movie_length
+        existing_movie.last_synced_at = datetime.now()
         
         # Update image URL if available
         if movie_details.get("poster_path"):
@@ -177,27 +284,53 @@ def update_movie_info(db: Session, movie_id: int):
         return True
         
     except Exception as e:
-        print(f"Error updating movie ID {movie_id}: {e}")
+        print(f"Error updating movie ID {tmdb_id}: {e}")
         db.rollback()
         return False
 
+def update_changed_movies(db: Session, since: datetime, until: Optional[datetime] = None):
+    """
+    Update only the stored movies TMDB reports as changed in [since, until]
+
+    Costs one changes-feed page per 100 changes plus one request per stored
+    movie that changed, instead of one per catalog movie. Returns
+    (updated, failed) counts.
+    """
+    until = until or datetime.now()
+    changed_ids = fetch_changed_movie_ids(since.strftime("%Y-%m-%d"), until.strftime("%Y-%m-%d"))
+    print(f"TMDb reports {len(changed_ids)} changed movies since {since:%Y-%m-%d}")
+    if not changed_ids:
+        return 0, 0
+
+    # the feed covers all of TMDB, only the movies we store need refreshing
+    stored_ids = []
+    changed_ids = list(changed_ids)
+    for start in range(0, len(changed_ids), 1000):
+        chunk = changed_ids[start:start + 1000]
+        stored_ids.extend(tmdb_id for (tmdb_id,) in db.query(Movie.tmdb_id).filter(Movie.tmdb_id.in_(chunk)))
+
+    updated_count = 0
+    for tmdb_id in stored_ids:
+        if update_movie_info(db, tmdb_id):
+            updated_count += 1
+    print(f"Updated {updated_count} of {len(stored_ids)} changed movies")
+    if updated_count:
+        refresh_movie_cards(db)
+    return updated_count, len(stored_ids) - updated_count
+
 def update_all_movies(db: Session):
     """
     Update all movies in the database with latest TMDB information
     """
-    movies = db.query(Movie).all()
+    tmdb_ids = [tmdb_id for (tmdb_id,) in db.query(Movie.tmdb_id).filter(Movie.tmdb_id.isnot(None))]
     updated_count = 0
     
-    for movie in movies:
-        # Note: This assumes you have a tmdb_id field or can derive it
-        # You may need to modify this based on your Movie model
-        if hasattr(movie, 'tmdb_id'):
-            if update_movie_info(db, movie.tmdb_id):
-                updated_count += 1
-        else:
-            print(f"Warning: Movie '{movie.title}' doesn't have TMDB ID for updating")
+    for tmdb_id in tmdb_ids:
+        if update_movie_info(db, tmdb_id):
+            updated_count += 1
     
     print(f"Updated {updated_count} movies")
+    refresh_movie_cards(db)
 
 def populate_movies(db: Session, start_date: Optional[str] = None, end_date: Optional[str] = None):
     """
@@ -218,84 +351,20 @@ def populate_movies(db: Session, start_date: Optional[str] = None, end_date: Opt
         print("Fetching all movies (no date filter)")
         movies = fetch_movies_from_tmdb()
     
-    added_count = 0
-    skipped_count = 0
-    
-    for movie_data in movies:
-        try:
-            movie_id = movie_data.get("id")
-            title = movie_data.get("title")
-            if not movie_id or not title:
-                continue
-            
-            # Skip duplicate movies
-            existing_movie = db.query(Movie).filter(Movie.title == title).first()
-            if existing_movie:
-                print(f"Movie '{title}' already exists. Skipping.")
-                skipped_count += 1
-                continue
-            
-            movie_details = fetch_movie_details(movie_id)
-            if not movie_details:
-                continue
-            
-            description = movie_details.get("overview")
-            release_date_str = movie_details.get("release_date")
-            
-            # Ensure release_date is parsed correctly
-            try:
-                release_date = datetime.strptime(release_date_str, "%Y-%m-%d") if release_date_str else None
-            except ValueError as e:
-                print(f"Error parsing release date for movie '{title}': {e}")
-                release_date = None
-
-            rating = movie_details.get("vote_average")
-            movie_length = movie_details.get("runtime") or 120
-            image_url = f"https://image.tmdb.org/t/p/w500{movie_details.get('poster_path')}" if movie_details.get("poster_path") else None
-
-            new_movie = Movie(
-                title=title,
-                description=description,
-                movie_length=movie_length,
-                rating=rating,
-                image_url=image_url,
-                release_date=release_date
-            )
-            db.add(new_movie)
-            db.commit()
-            db.refresh(new_movie)
-
-            # Add genres
-            genres = movie_details.get("genres", [])
-            for genre in genres:
-                genre_name = genre.get("name")
-                if genre_name:
-                    genre_to_movie = GenresToMovie(movie_id=new_movie.movie_id, genre_name=genre_name)
-                    db.add(genre_to_movie)
-
-            # Add director
-            director_name = fetch_director_name(movie_id)
-            if director_name:
-                director_to_movie = DirectorToMovie(movie_id=new_movie.movie_id, director_name=director_name)
-                db.add(director_to_movie)
-            
-            # Add actors
-            actors = fetch_actor_names(movie_id)
-            for actor_name in actors:
-                if actor_name:
-                    actor_to_movie = ActorToMovie(movie_id=new_movie.movie_id, actor_name=actor_name)
-                    db.add(actor_to_movie)
-            
-            db.commit()
-            added_count += 1
-            print(f"Added movie '{title}' ({release_date_str}) to database")
-            
-        except Exception as e:
-            print(f"Error processing movie '{title}': {e}")
-            db.rollback()
-            continue
-    
-    print(f"Database population complete: {added_count} movies added, {skipped_count} skipped")
+    listed = [movie_data for movie_data in movies if movie_data.get("id") and movie_data.get("title")]
+    # a details request is only spent on movies that are not stored yet
+    to_fetch = unstored_movies(db, listed)
+    print(f"{len(listed) - len(to_fetch)} listed movies are already stored")
+
+    with MovieBatchWriter(db) as writer:
+        for movie_data in to_fetch:
+            movie_details = fetch_movie_details(movie_data["id"])
+            if movie_details:
+                writer.add(movie_details, movie_details.get("credits"))
+
+    print(f"Database population complete: {writer.added} movies added, {len(movies) - writer.added} skipped")
+    if writer.added:
+        refresh_movie_cards(db)
 
 if __name__ == "__main__":
     db = next(get_db()) 
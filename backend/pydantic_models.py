@@ -84,7 +84,9 @@ class SearchParams(BaseModel):
     min_rating: Optional[float] =None
     genres: Optional[List[str]] = None
     sort_by: Optional[str] = None
-    page: int
+    page: int = 1
+    # nextCursor from the previous page; when set, page is ignored
+    cursor: Optional[str] = None
 
 class DirectorToMovieModel(BaseModel):
     movie_id: int
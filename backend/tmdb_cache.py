@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# optional SQLite file TMDB responses are cached in; caching is off when unset
+TMDB_CACHE_PATH = os.getenv("TMDB_CACHE_PATH")
+TMDB_CACHE_TTL = int(os.getenv("TMDB_CACHE_TTL", 24 * 60 * 60))
+
+# never part of the key, so cached responses are shared across API keys and safe to hand around
+IGNORED_PARAMS = {"api_key"}
+
+class ResponseCache:
+    """
+    On-disk cache of TMDB JSON responses keyed by URL and query parameters.
+
+    Bodies are stored zlib-compressed in one SQLite table. Entries older than
+    ttl_seconds are treated as missing and replaced on the next store.
+    A cache file filled by one run can be reused as an offline fixture.
+    """
+    def __init__(self, path: str, ttl_seconds: float = TMDB_CACHE_TTL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL NOT NULL, body BLOB NOT NULL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url: str, params: Optional[dict] = None) -> str:
+        query = sorted((str(key), str(value)) for key, value in (params or {}).items() if key not in IGNORED_PARAMS)
+        return url + "?" + "&".join(f"{key}={value}" for key, value in query)
+
+    def get(self, url: str, params: Optional[dict] = None):
+        key = self.make_key(url, params)
+        with self._lock:
+            row = self._conn.execute("SELECT stored_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] + self.ttl_seconds <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def set(self, url: str, params: Optional[dict], data):
+        body = zlib.compress(json.dumps(data).encode())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stored_at, body) VALUES (?, ?, ?)",
+                (self.make_key(url, params), time.time(), body),
+            )
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses WHERE stored_at <= ?", (time.time() - self.ttl_seconds,))
+
+_response_cache = {"cache": None}
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Shared cache for TMDB_CACHE_PATH, or None when caching is not configured"""
+    if not TMDB_CACHE_PATH:
+        return None
+    with _response_cache_lock:
+        if _response_cache["cache"] is None:
+            _response_cache["cache"] = ResponseCache(TMDB_CACHE_PATH)
+            logger.info(f"Caching TMDB responses in {TMDB_CACHE_PATH} for {TMDB_CACHE_TTL}s")
+        return _response_cache["cache"]
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from sqlalchemy.orm import Session
+from movie_writer import parse_movie, write_movies, refresh_movie_cards
+from tmdb_cache import get_response_cache
+
+logger = logging.getLogger(__name__)
+
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+# TMDB allows roughly 40-50 requests per second per IP; stay under it
+TMDB_REQUESTS_PER_SECOND = 40
+TMDB_MAX_CONCURRENCY = 20
+# pages on which a movie whose details could not be fetched is tried again before it is given up
+TMDB_PENDING_ATTEMPTS = 3
+
+class TokenBucket:
+    """Async token bucket: refills `rate` tokens per second and bursts up to `capacity`"""
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+def retry_after_seconds(value: Optional[str], default: float) -> float:
+    """Seconds to wait for a Retry-After header, given as seconds or as an HTTP date"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class AsyncTMDBClient:
+    """
+    aiohttp client for the TMDB API sharing one token bucket and one
+    connection pool across every request.
+
+    Successful responses go through the same response cache as the sync
+    client when TMDB_CACHE_PATH is set.
+
+    base_url can point at a local stub server for offline runs.
+    """
+    def __init__(self, api_key: str, base_url: str = TMDB_BASE_URL,
+                 requests_per_second: float = TMDB_REQUESTS_PER_SECOND,
+                 max_concurrency: int = TMDB_MAX_CONCURRENCY, retries: int = 3):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.max_concurrency = max_concurrency
+        self.limiter = TokenBucket(requests_per_second)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def get(self, path: str, params: dict = None) -> Optional[dict]:
+        """GET a TMDB path with rate limiting and retries; returns None on a client error or once retries are exhausted"""
+        query = {"api_key": self.api_key, "language": "en-US"}
+        for key, value in (params or {}).items():
+            query[key] = str(value)
+        url = f"{self.base_url}{path}"
+        cache = get_response_cache()
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, url, query)
+            if cached is not None:
+                return cached
+
+        for attempt in range(self.retries):
+            await self.limiter.acquire()
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    async with self._session.get(url, params=query) as response:
+                        if response.status == 429:
+                            retry_after = retry_after_seconds(response.headers.get("Retry-After"), 2 ** attempt)
+                        elif 400 <= response.status < 500:
+                            # a missing movie or a bad key answers the same way every time
+                            logger.warning(f"Request to {path} failed with {response.status}, not retrying")
+                            return None
+                        else:
+                            response.raise_for_status()
+                            data = await response.json()
+                if retry_after is not None:
+                    # wait with the response closed and the concurrency slot released
+                    logger.warning(f"Rate limited on {path}, retrying in {retry_after}s")
+                    await asyncio.sleep(retry_after)
+                    continue
+                if cache is not None:
+                    await asyncio.to_thread(cache.set, url, query, data)
+                return data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Request to {path} failed (attempt {attempt + 1}/{self.retries}): {e}")
+                if attempt < self.retries - 1:
+                    await asyncio.sleep(2 ** attempt)
+        logger.error(f"Giving up on {path} after {self.retries} attempts")
+        return None
+
+class IngestionCheckpoint:
+    """
+    Backfill position (year, page) persisted to a JSON file, together with
+    the TMDB ids still pending a retry and how often each was tried.
+
+    A page is recorded only once it has been written, so a restarted run
+    resumes with the first page that might be missing.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.year = None
+        self.page = 0
+        self.pending = {}
+
+    def load(self) -> bool:
+        """Read the saved position, returns False when there is none"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.year, self.page = state["year"], state["page"]
+            self.pending = {int(tmdb_id): attempts for tmdb_id, attempts in state.get("pending", {}).items()}
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return False
+        return True
+
+    def save(self, year: int, page: int, pending: Optional[Dict[int, int]] = None):
+        self.year, self.page = year, page
+        if pending is not None:
+            self.pending = dict(pending)
+        # write next to the target and rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"year": self.year, "page": self.page, "pending": self.pending}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.year, self.page, self.pending = None, 0, {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class AsyncIngestionPipeline:
+    """
+    Concurrent replacement for DatabaseInitializer's serial year/page/movie loops.
+
+    Within a year, the popular and top-rated discover pages are fetched
+    together, then every new movie on them is fetched concurrently, one
+    combined details+credits request each. Writing a page to the database overlaps with
+    fetching the next one. Each page is written as one batch on a worker
+    thread, one page at a time, so the session is never used from two
+    threads at once.
+
+    A movie whose details request fails is not marked as seen. It stays
+    pending and is tried again with the next pages, up to
+    TMDB_PENDING_ATTEMPTS times. With a checkpoint, progress and the pending
+    ids are saved after every written page and run() resumes from there.
+    """
+    def __init__(self, client: AsyncTMDBClient, initializer, db: Session, max_pages: int = 5,
+                 checkpoint: Optional[IngestionCheckpoint] = None):
+        self.client = client
+        self.initializer = initializer
+        self.db = db
+        self.max_pages = max_pages
+        self.checkpoint = checkpoint
+        self.seen_ids = initializer.processed_movies
+        # TMDB id -> failed attempts, for movies whose details could not be fetched yet
+        self.pending = {}
+        self.movies_processed = 0
+        self.movies_added = 0
+
+    async def fetch_discover_page(self, year: int, page: int, sort_by: str, extra: dict = None) -> List[Dict]:
+        params = {
+            "primary_release_year": year,
+            "sort_by": sort_by,
+            "page": page,
+            "vote_count.gte": 10,
+        }
+        params.update(extra or {})
+        data = await self.client.get("/discover/movie", params)
+        return data.get("results", []) if data else []
+
+    async def fetch_movie(self, movie_data: dict) -> Tuple[dict, Optional[dict], Optional[dict]]:
+        # credits ride along on the details request instead of costing a second call
+        details = await self.client.get(f"/movie/{movie_data['id']}", {"append_to_response": "credits"})
+        credits = details.get("credits") if details else None
+        return movie_data, details, credits
+
+    def _write_page(self, fetched) -> int:
+        # the whole page goes to the database as one batch, in one transaction
+        self.movies_processed += len(fetched)
+        added = write_movies(self.db, [parse_movie(details, credits) for _, details, credits in fetched if details])
+        self.movies_added += added
+        return added
+
+    async def _finish_write(self, year: int, pending_write) -> int:
+        page, pending, task = pending_write
+        added = await task
+        if self.checkpoint:
+            self.checkpoint.save(year, page, pending)
+        return added
+
+    async def fetch_candidates(self, candidates: Dict[int, dict]):
+        """Fetch the candidates and the pending retries; only fetched movies are marked as seen"""
+        retries = {tmdb_id: {"id": tmdb_id} for tmdb_id in self.pending if tmdb_id not in candidates}
+        fetched = await asyncio.gather(*(self.fetch_movie(movie) for movie in {**candidates, **retries}.values()))
+        for movie, details, _ in fetched:
+            tmdb_id = movie["id"]
+            if details:
+                self.seen_ids.add(tmdb_id)
+                self.pending.pop(tmdb_id, None)
+                continue
+            attempts = self.pending.get(tmdb_id, 0) + 1
+            if attempts < TMDB_PENDING_ATTEMPTS:
+                self.pending[tmdb_id] = attempts
+            else:
+                self.pending.pop(tmdb_id, None)
+                self.seen_ids.add(tmdb_id)
+                logger.error(f"Giving up on TMDB movie {tmdb_id} after {attempts} failed attempts")
+        return [entry for entry in fetched if entry[1]]
+
+    async def ingest_year(self, year: int, first_page: int = 1) -> int:
+        year_start_time = time.time()
+        year_added = 0
+        pending_write = None
+
+        try:
+            for page in range(first_page, self.max_pages + 1):
+                popular, top_rated = await asyncio.gather(
+                    self.fetch_discover_page(year, page, "popularity.desc"),
+                    self.fetch_discover_page(year, page, "vote_average.desc", {"vote_average.gte": 3.0}),
+                )
+                if not popular and not top_rated:
+                    break
+
+                candidates = {}
+                for movie in popular + top_rated:
+                    if movie.get("id") and movie["id"] not in self.seen_ids:
+                        candidates[movie["id"]] = movie
+                fetched = await self.fetch_candidates(candidates)
+
+                if pending_write is not None:
+                    year_added += await self._finish_write(year, pending_write)
+                pending_write = (page, dict(self.pending), asyncio.create_task(asyncio.to_thread(self._write_page, fetched)))
+                logger.info(f"Year {year} page {page}: fetched {len(fetched)} new movies, {len(self.pending)} pending")
+        except BaseException:
+            # the write still holds the session, let it finish before the error propagates;
+            # its page is not checkpointed, a restart refetches it and skips the ids it stored
+            if pending_write is not None:
+                await asyncio.wait([pending_write[2]])
+            raise
+
+        if pending_write is not None:
+            year_added += await self._finish_write(year, pending_write)
+        if self.checkpoint:
+            self.checkpoint.save(year + 1, 0, self.pending)
+        logger.info(f"Year {year} completed: {year_added} movies added in {time.time() - year_start_time:.1f} seconds")
+        return year_added
+
+    async def run(self, start_year: int, end_year: int):
+        first_page = 1
+        if self.checkpoint and self.checkpoint.load() and start_year <= self.checkpoint.year:
+            start_year, first_page = self.checkpoint.year, self.checkpoint.page + 1
+            self.pending = dict(self.checkpoint.pending)
+            logger.info(f"Resuming from checkpoint: year {start_year}, page {first_page} "
+                        f"({len(self.pending)} movies pending a retry)")
+        logger.info(f"Starting concurrent ingestion from {start_year} to {end_year}")
+        for year in range(start_year, end_year + 1):
+            await self.ingest_year(year, first_page)
+            first_page = 1
+        # movies that failed on the last pages get their remaining attempts here
+        while self.pending:
+            fetched = await self.fetch_candidates({})
+            if fetched:
+                await asyncio.to_thread(self._write_page, fetched)
+        if self.checkpoint:
+            self.checkpoint.clear()
+        logger.info(f"Ingestion complete: {self.movies_processed} movies processed, {self.movies_added} added")
+        refresh_movie_cards(self.db)